@@ -2,6 +2,7 @@
 #
 # -------------------------------------------------------------------------------------------------
 
+import atexit
 import logging
 from logging.handlers import RotatingFileHandler
 import os
@@ -9,7 +10,6 @@ import sys
 
 from flask import Flask
 from flask_login import LoginManager
-from flask_sqlalchemy import SQLAlchemy
 
 import lego.util as util
 
@@ -25,23 +25,62 @@ except ImportError:
 app = Flask(__name__)
 app.config.from_object(config)
 
-# initialise logging
-app.logger.addHandler(util.create_log_handler('app'))
+# initialise logging. Records are written to the log file by a background thread so requests never
+# wait on the disk
+log_level = app.config.get('LOG_LEVEL', 'INFO')
+log_handler = util.create_log_handler('app', log_level,
+                                      structured=app.config.get('LOG_FORMAT', 'json') == 'json')
+queue_handler, app.log_listener = util.create_queue_handler(log_handler)
+app.logger.addHandler(queue_handler)
+app.logger.setLevel(log_level)
+app.log_listener.start()
+# the listener is replaced when serving with several workers, see lego.server
+atexit.register(lambda: app.log_listener.stop())
 
-# database
-db = SQLAlchemy(app)
+# events, each with their own database and stage, see lego.events
+from lego import events
+
+# database, using the database of the event being handled
+db = events.EventSQLAlchemy(app)
 
 # login manager
 lm = LoginManager()
 lm.init_app(app)
 lm.login_view = 'login'
 
-app.load_stage = util.load_stage
+# the stage file can be moved, e.g. for testing. Older config.py files won't set this
+if app.config.get('STAGE_PATH'):
+    util.stage_store = util.StageStore(app.config['STAGE_PATH'])
+
+app.load_stage = events.load_stage
+app.save_stage = events.save_stage
+
+if events.events:
+    app.wsgi_app = events.EventDispatcher(app.wsgi_app, events.events)
 
 # imports of modules that require app
-from lego import cli, routes
+from lego import cli, metrics, pragmas, routes
 from lego.models import User
 
+# the logged in users, so judges submitting scores don't load their user on every request
+user_cache = util.LRUCache(64, ttl=app.config.get('USER_CACHE_TTL', 60))
+
 @lm.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    # users are cached per event as each event has its own database
+    key = (events.current_name(), id)
+    user = user_cache.get(key) if user_cache.ttl else None
+
+    if user is None:
+        user = User.query.get(int(id))
+
+        if user is None:
+            return None
+
+        # detach the user so committing the request's changes doesn't expire it for later requests
+        db.session.expunge(user)
+
+        if user_cache.ttl:
+            user_cache.set(key, user)
+
+    return user
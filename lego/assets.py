@@ -0,0 +1,92 @@
+# -----------------------------------------------------------------------------
+# Content hashes of the static files, for cache busting.
+#
+# The hash of each static file is added to its URL, so browsers can cache it
+# forever and never have to check whether it has changed: a changed file gets
+# a new URL. The hashes are built once at startup. In debug mode a file is
+# re-hashed when it changes, so edits show up without restarting.
+# -----------------------------------------------------------------------------
+
+import hashlib
+import os
+import threading
+
+
+__all__ = ['AssetManifest', 'IMMUTABLE']
+
+# the Cache-Control header for static files requested with their current hash
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# the number of hex digits of the hash to use in URLs
+HASH_LENGTH = 12
+
+
+class AssetManifest(object):
+    '''
+    The content hash of every file in a directory, keyed by its path relative to the directory
+    using `/` as the separator, as used in `url_for('static', filename=...)`.
+    '''
+
+    def __init__(self, root: str):
+        '''
+        :param root: The directory holding the files, e.g. the static folder.
+        '''
+        self.root = root
+        # filename to (modification time, hash)
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def build(self):
+        '''
+        Hash every file in the directory, replacing any previous hashes.
+        '''
+        hashes = {}
+
+        for dir_path, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dir_path, name)
+                filename = os.path.relpath(path, self.root).replace(os.sep, '/')
+                hashes[filename] = (os.stat(path).st_mtime_ns, _hash_file(path))
+
+        with self._lock:
+            self._hashes = hashes
+
+    def get(self, filename: str, refresh: bool=False) -> str:
+        '''
+        Get the hash of a file.
+
+        :param filename: The path of the file relative to the directory.
+        :param refresh: Re-hash the file if it has changed since it was hashed, e.g. in debug mode.
+            Otherwise files are only hashed by `build`.
+
+        :return: The hash, or None if the file isn't in the directory.
+        '''
+        entry = self._hashes.get(filename)
+
+        if not refresh:
+            return entry[1] if entry else None
+
+        path = os.path.join(self.root, *filename.split('/'))
+
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, _hash_file(path))
+
+            with self._lock:
+                self._hashes[filename] = entry
+
+        return entry[1]
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(64 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()[:HASH_LENGTH]
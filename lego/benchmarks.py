@@ -0,0 +1,234 @@
+# -----------------------------------------------------------------------------
+# Microbenchmarks of the functions on the scoreboard and judging hot paths.
+#
+# Each benchmark is timed over a generated set of teams at each size and, where
+# the work depends on it, at each stage. The teams are built in memory rather
+# than loaded from a database so only the function itself is measured. The
+# same seed is used for every run, so results from before and after a change
+# can be compared directly.
+# -----------------------------------------------------------------------------
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import cmp_to_key
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+
+from flask import render_template
+from werkzeug.datastructures import MultiDict
+
+from lego import app, ranking, util
+from lego.forms import ScoreRoundForm
+from lego.forms.score_round_form import MISSIONS_PATH
+from lego.leaderboard import Entry
+from lego.loadtest import random_sheet
+from lego.models import Score, Team
+from lego.models.score import SLOTS
+from lego.routes import scoreboard_params, slugify, top_ten_params
+
+
+__all__ = ['BENCHMARKS', 'SIZES', 'STAGES', 'run']
+
+# the default numbers of teams and stages to benchmark at
+SIZES = (10, 100, 1000, 10000)
+STAGES = (0, 1, 2, 3, 4)
+
+SEED = 2018
+
+# the default number of seconds to spend repeating each benchmark
+BUDGET = 5.0
+
+# team names, with the punctuation and accents slugify has to deal with
+_NAMES = ('Brick Breakers', 'Los Robóticos', 'The Lego-Nauts!', 'Mind Stormers', 'Über Bots',
+          'St. Mary\'s Techies', 'Gear Heads (Year 7)', 'Café Coders')
+
+
+class _Fixture(object):
+    '''
+    The generated teams, score sheets and names for a single size.
+    '''
+
+    def __init__(self, size: int):
+        rng = random.Random(SEED)
+
+        with open(MISSIONS_PATH) as fh:
+            missions = json.load(fh)
+
+        self.size = size
+        self.teams = []
+        self.sheets = [random_sheet(missions, rng) for _ in range(size)]
+        self._rows = []
+
+        for number in range(1, size + 1):
+            # a few teams miss each attempt, as on the day
+            scores = {k: rng.randrange(0, 400, 5) for k in SLOTS if rng.random() < 0.9}
+            row = (number, number, 'Team {:d}: {!s}'.format(number, rng.choice(_NAMES)), True)
+
+            team = Team(id=row[0], number=row[1], name=row[2], active=row[3], is_practice=False)
+            team.scores = [Score(stage=SLOTS[k][0], attempt=SLOTS[k][1], total=v)
+                           for k, v in scores.items()]
+
+            self.teams.append(team)
+            self._rows.append((row, scores))
+
+        self.names = [t.name for t in self.teams]
+        self._forms = None
+        self._entries = {}
+
+    @property
+    def forms(self) -> list:
+        '''
+        Score forms holding each score sheet as submitted, built the first time they are needed.
+        '''
+        if self._forms is None:
+            with app.test_request_context():
+                self._forms = [ScoreRoundForm(formdata=MultiDict(s), meta={'csrf': False})
+                               for s in self.sheets]
+
+        return self._forms
+
+    def entries(self, stage: int) -> list:
+        '''
+        The teams ranked for a stage, as the leaderboard holds them.
+        '''
+        if stage not in self._entries:
+            entries = [Entry(row, scores, stage) for row, scores in self._rows]
+            self._entries[stage] = ranking.rank_teams(entries, stage)
+
+        return self._entries[stage]
+
+
+def _render(template: str, params: dict):
+    with app.test_request_context():
+        return render_template(template, **params)
+
+
+# the benchmarks as (name, whether it depends on the stage, function taking the fixture and stage
+# and returning the callable to time)
+BENCHMARKS = (
+    ('sort_compare_teams', True,
+     lambda f, stage: lambda: sorted(f.teams, key=cmp_to_key(util.compare_teams))),
+    ('rank_teams', True,
+     lambda f, stage: lambda: ranking.rank_teams(f.teams, stage)),
+    ('highest_score', True,
+     lambda f, stage: lambda: [t.highest_score for t in f.teams]),
+    ('points_scored', False,
+     lambda f, stage: lambda: [form.points_scored() for form in f.forms]),
+    ('slugify', False,
+     lambda f, stage: lambda: [slugify(n) for n in f.names]),
+    ('render_scoreboard_bristol', True,
+     lambda f, stage: lambda: _render('scoreboard_bristol.html',
+                                      scoreboard_params(f.entries(stage), stage, 'bristol'))),
+    # the uk round 1 scoreboard is shown a page of 10 teams at a time
+    ('render_scoreboard_uk', True,
+     lambda f, stage: lambda: _render('scoreboard_uk.html',
+                                      scoreboard_params(f.entries(stage)[:10] if stage == 0
+                                                        else f.entries(stage), stage, 'uk',
+                                                        end=f.size))),
+    ('render_top_ten', True,
+     lambda f, stage: lambda: _render('top_ten.html',
+                                      top_ten_params(f.entries(stage)[:10], stage))),
+)
+
+
+@contextmanager
+def _temporary_stage():
+    '''
+    Use a temporary stage file, so the stage can be changed without affecting the application.
+    '''
+    store = util.stage_store
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        util.stage_store = util.StageStore(os.path.join(tmp_dir, '.stage'))
+
+        try:
+            yield util.stage_store
+        finally:
+            util.stage_store = store
+
+
+def _time(func, repeat: int, budget: float) -> list:
+    '''
+    Time a function, returning the time taken by each call in seconds. Stops early once the calls
+    have taken longer than the budget, but always times at least one call.
+    '''
+    times = []
+
+    while len(times) < repeat and sum(times) < budget:
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def run(sizes=SIZES, stages=STAGES, repeat: int=5, budget: float=BUDGET, names=None,
+        progress=None) -> OrderedDict:
+    '''
+    Run the benchmarks.
+
+    :param sizes: The numbers of teams to benchmark with.
+    :param stages: The stages to benchmark at. Benchmarks which don't depend on the stage are only
+        run once per size.
+    :param repeat: How many times to time each benchmark. The best and median times are reported.
+    :param budget: The number of seconds after which a benchmark is not repeated any more, so the
+        slowest benchmarks at the largest sizes don't hold up the run.
+    :param names: The names of the benchmarks to run. Defaults to all of `BENCHMARKS`.
+    :param progress: A function called with each result as it is produced, e.g. for printing.
+
+    :return: A dict holding the settings used and a list of results, each holding the benchmark
+        name, the number of teams, the stage (None if it doesn't depend on the stage), the number
+        of times it was timed, the best and median times in milliseconds and the best time per
+        team in microseconds.
+    '''
+    unknown = set(names or ()) - {b[0] for b in BENCHMARKS}
+
+    if unknown:
+        raise ValueError('Unknown benchmarks: {!s}'.format(', '.join(sorted(unknown))))
+
+    benchmarks = [b for b in BENCHMARKS if not names or b[0] in names]
+    results = []
+
+    with _temporary_stage() as store:
+        for size in sizes:
+            fixture = _Fixture(size)
+
+            for name, per_stage, build in benchmarks:
+                for stage in (stages if per_stage else (None,)):
+                    store.save(stage or 0)
+                    func = build(fixture, stage)
+
+                    # warm up caches, e.g. compiled templates, before timing
+                    func()
+                    times = _time(func, repeat, budget)
+
+                    result = OrderedDict([
+                        ('name', name),
+                        ('teams', size),
+                        ('stage', stage),
+                        ('runs', len(times)),
+                        ('best_ms', round(min(times) * 1000, 3)),
+                        ('median_ms', round(statistics.median(times) * 1000, 3)),
+                        ('per_team_us', round(min(times) * 1e6 / size, 3)),
+                    ])
+                    results.append(result)
+
+                    if progress:
+                        progress(result)
+
+    return OrderedDict([
+        ('settings', OrderedDict([
+            ('sizes', list(sizes)),
+            ('stages', list(stages)),
+            ('repeat', repeat),
+            ('budget', budget),
+            ('seed', SEED),
+            ('python', platform.python_version()),
+        ])),
+        ('results', results),
+    ])
@@ -0,0 +1,154 @@
+# -----------------------------------------------------------------------------
+# Storage of score breakdowns.
+#
+# A breakdown holds the points scored for each mission. It is stored as a
+# compact JSON object keyed by mission ID, the part of the mission name before
+# ` - `, e.g. `M01`, leaving out missions which scored nothing:
+#
+#     {"M01":22,"M05":16,"Penalties":-3}
+#
+# A single mission's points can be read without decoding the whole breakdown,
+# in Python with `BreakdownCodec.points` or in SQL with `points_expression`.
+# Breakdowns stored by older versions of the application as the repr of an
+# OrderedDict can still be decoded, and are converted by `flask upgrade-db`.
+# -----------------------------------------------------------------------------
+
+from collections import OrderedDict
+import json
+import re
+
+from sqlalchemy import case, func, null
+
+from lego.util import parse_breakdown
+
+
+__all__ = ['BreakdownCodec', 'mission_id', 'points_expression', 'stored_points']
+
+# the start of breakdowns stored as the repr of an OrderedDict
+LEGACY_PREFIX = 'OrderedDict('
+
+
+def mission_id(name: str) -> str:
+    '''
+    Get the ID of a mission used in stored breakdowns, e.g. `M01` for `M01 - Space Travel`.
+    '''
+    return name.split(' - ', 1)[0].strip()
+
+
+def stored_points(value: str) -> dict:
+    '''
+    Read a stored breakdown as it is stored, without the missions which scored nothing.
+
+    :param value: The stored breakdown. May be empty or None.
+
+    :return: The points keyed by mission ID, or None if there is no breakdown.
+    '''
+    if not value:
+        return None
+
+    if value.startswith(LEGACY_PREFIX):
+        return {mission_id(name): p for name, p in parse_breakdown(value).items() if p}
+
+    return json.loads(value)
+
+
+def points_expression(column, name: str):
+    '''
+    Build a SQL expression for the points a mission scored in a stored breakdown, e.g. for summing
+    a mission's points over every score. Needs SQLite's JSON functions, built in since 3.38.
+
+    :param column: The breakdown column, e.g. `Score.breakdown`.
+    :param name: The mission name or ID.
+
+    :return: The points, 0 if the mission scored nothing, or NULL if there is no breakdown.
+    '''
+    path = '$."{!s}"'.format(mission_id(name))
+
+    return case([(func.coalesce(column, '') == '', null())],
+                else_=func.coalesce(func.json_extract(column, path), 0))
+
+
+class BreakdownCodec(object):
+    '''
+    Encodes and decodes the stored breakdowns for a set of missions.
+    '''
+
+    def __init__(self, missions):
+        '''
+        :param missions: The mission names, in the order they are scored, e.g.
+            `ScoringProgram.missions`.
+
+        :raises ValueError: If two missions have the same ID.
+        '''
+        self.missions = tuple(missions)
+        self._ids = OrderedDict((name, mission_id(name)) for name in self.missions)
+        self._names = {i: name for name, i in self._ids.items()}
+        self._patterns = {}
+
+        if len(self._names) != len(self.missions):
+            raise ValueError('Mission IDs must be unique: {!s}'.format(', '.join(self.missions)))
+
+    def encode(self, breakdown: dict) -> str:
+        '''
+        Encode a breakdown for storing.
+
+        :param breakdown: The points scored for each mission keyed by mission name, as returned by
+            `ScoringProgram.score`.
+
+        :return: The encoded breakdown.
+        '''
+        ids = self._ids
+        points = OrderedDict((ids.get(name) or mission_id(name), value)
+                             for name, value in breakdown.items() if value)
+
+        return json.dumps(points, separators=(',', ':'))
+
+    def decode(self, value: str) -> OrderedDict:
+        '''
+        Decode a stored breakdown, including those stored by older versions of the application.
+
+        :param value: The stored breakdown. May be empty or None.
+
+        :return: The points scored for each mission keyed by mission name, in mission order. Empty
+            if there is no breakdown.
+        '''
+        if not value:
+            return OrderedDict()
+
+        if value.startswith(LEGACY_PREFIX):
+            return parse_breakdown(value)
+
+        stored = json.loads(value)
+        breakdown = OrderedDict((name, stored.pop(i, 0)) for name, i in self._ids.items())
+
+        # missions which are no longer in the set, e.g. from a previous season
+        for i, points in stored.items():
+            breakdown[self._names.get(i, i)] = points
+
+        return breakdown
+
+    def points(self, value: str, name: str):
+        '''
+        Get the points a single mission scored in a stored breakdown, without decoding the rest.
+
+        :param value: The stored breakdown.
+        :param name: The mission name or ID.
+
+        :return: The points, 0 if the mission scored nothing, or None if there is no breakdown.
+        '''
+        if not value:
+            return None
+
+        if value.startswith(LEGACY_PREFIX):
+            name = self._names.get(name, name)
+            return parse_breakdown(value).get(name, 0)
+
+        i = self._ids.get(name) or mission_id(name)
+        pattern = self._patterns.get(i)
+
+        if pattern is None:
+            pattern = self._patterns[i] = re.compile('"{!s}":(-?\\d+)'.format(re.escape(i)))
+
+        match = pattern.search(value)
+
+        return int(match.group(1)) if match else 0
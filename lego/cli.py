@@ -5,23 +5,43 @@
 # - init: Initialises the application database, creates the default users, creates the practice
 #       team and sets the stage.
 # - secret: Generates a secret key to be used in config.py.
-# - add-teams: Add teams to the database.
+# - add-teams: Add teams to the database in bulk.
 # - list-teams: List the teams currently in the database.
 # - reset-teams: Remove all non-practice teams from the database.
+# - import-scores: Import score sheets from a file in bulk.
 # - stage: Move the stage forwards or backwards. This is for advanced usage only and should not be
 #       required while running the event itself.
+# - upgrade-db: Upgrade a database created by an older version of the application.
+# - serve: Run the application with several worker processes, for the event days.
+# - load-test: Simulate scoreboards and judges against a temporary copy of the application.
+# - bench: Benchmark the ranking, scoring and rendering functions.
+# - bench-db: Benchmark concurrent database reads and writes with and without the SQLite tuning.
 # -------------------------------------------------------------------------------------------------
 
 from base64 import b64encode
+import json
 import os
 from random import randint, seed
+import sqlite3
+import tempfile
+import threading
+import time
 
 import click
-from sqlalchemy import asc
+from sqlalchemy import asc, bindparam
 
 from lego import app, db
+from lego.benchmarks import BENCHMARKS, BUDGET, SIZES, STAGES, run as run_benchmarks
+from lego.formats import current_format
+from lego.leaderboard import leaderboard
+from lego.loadtest import run as run_load_test
+from lego.migrations import upgrade
 from lego.models import User, Team
+from lego.models.mission_stat import rebuild as rebuild_mission_stats
+from lego.pragmas import apply_pragmas, get_pragmas
 from lego.routes import set_active_teams
+from lego.score_import import import_scores as _import_scores, read_sheets
+from lego.server import serve as run_server
 
 # seed random number generation
 seed()
@@ -86,42 +106,106 @@ def secret():
 
 @app.cli.command('add-teams',
     short_help='Add teams to the database from a file.',
-    help='Add teams to the database from a file. The file should contain one team per line.')
+    help='Add teams to the database from a file. The file should contain one team per line. '
+         'The whole file is checked before any teams are added and nothing is added if there '
+         'are any problems.')
 @click.argument('file', type=click.File())
-def add_teams(file: str):
-    _add_teams(file)
+@click.option('--upsert', is_flag=True,
+              help='Rename teams whose numbers already exist instead of treating them as errors.')
+def add_teams(file: str, upsert: bool):
+    _add_teams(file, upsert)
 
-def _add_teams(file: str):
-    for line in file:
+def _add_teams(file: str, upsert: bool=False) -> bool:
+    '''
+    Helper for adding teams from a file in a single transaction.
+
+    :return: True if the teams were added, False if there were errors.
+    '''
+    errors = []
+    teams = []
+
+    for line_no, line in enumerate(file, start=1):
         line = line.strip()
 
         if not line:
             continue
 
-        number, name = line.split(',', 2)
+        try:
+            number, name = line.split(',', 1)
+        except ValueError:
+            errors.append((line_no, 'Expected "number, name": {!s}'.format(line)))
+            continue
+
         name = name.strip()
 
         try:
             number = int(number.strip())
             assert number > 0
         except (ValueError, AssertionError):
-            click.echo('Invalid number: {!s}'.format(number))
-            return
+            errors.append((line_no, 'Invalid number: {!s}'.format(number)))
+            continue
 
-        click.echo('Adding team: {!s} (number: {!s}).'.format(name, number))
+        if not name:
+            errors.append((line_no, 'Missing name for team {:d}'.format(number)))
+            continue
 
-        team = Team(number=number, name=name)
-        
-        db.session.add(team)
-        try:
-            db.session.commit()
-        except:
-            click.echo('ERROR: ONE OR MORE TEAMS/TEAM_NUM ALREADY EXIST')
-            click.echo(' ')
-            click.echo('Have you tried \'flask reset-teams\'? ')
-            return
-        else:
-            click.echo('Team successfully added.')
+        teams.append((line_no, number, name))
+
+    # check for duplicates within the file and against the existing teams in one pass
+    existing = dict(db.session.query(Team.number, Team.name))
+    existing_names = {n: num for num, n in existing.items()}
+    seen_numbers = {}
+    seen_names = {}
+    inserts = []
+    updates = []
+
+    for line_no, number, name in teams:
+        if number in seen_numbers:
+            errors.append((line_no, 'Number {:d} is also used on line {:d}'
+                                    .format(number, seen_numbers[number])))
+            continue
+
+        if name in seen_names:
+            errors.append((line_no, 'Name {!r} is also used on line {:d}'
+                                    .format(name, seen_names[name])))
+            continue
+
+        seen_numbers[number] = line_no
+        seen_names[name] = line_no
+
+        if existing_names.get(name, number) != number:
+            errors.append((line_no, 'Name {!r} is already used by team {:d}'
+                                    .format(name, existing_names[name])))
+            continue
+
+        if number not in existing:
+            inserts.append({'number': number, 'name': name})
+        elif not upsert:
+            errors.append((line_no, 'Team {:d} already exists'.format(number)))
+        elif existing[number] != name:
+            updates.append({'b_number': number, 'name': name})
+
+    if errors:
+        for line_no, error in sorted(errors):
+            click.echo('ERROR: Line {:d}: {!s}'.format(line_no, error))
+
+        click.echo('No teams were added. Have you tried \'flask reset-teams\'?')
+        return False
+
+    if updates:
+        table = Team.__table__
+        db.session.execute(table.update().where(table.c.number == bindparam('b_number'))
+                                .values(name=bindparam('name')),
+                           updates)
+
+    if inserts:
+        db.session.execute(Team.__table__.insert(), inserts)
+
+    db.session.commit()
+    leaderboard.invalidate()
+
+    click.echo('{:d} teams added, {:d} teams renamed.'.format(len(inserts), len(updates)))
+    return True
 
 
 @app.cli.command('reset-teams',
@@ -135,6 +219,7 @@ def reset_teams(y: bool):
         click.confirm('Do you wish to continue?', abort=True)
 
     Team.query.filter_by(is_practice=False).delete()
+    rebuild_mission_stats()
     db.session.commit()
     click.echo('Teams deleted.')
 
@@ -161,6 +246,30 @@ def list_teams(no_practice: bool, active: bool):
         click.echo('  {:<6}   {!s}'.format(t.number, t.name))
 
 
+@app.cli.command('import-scores', short_help='Import score sheets from a file.',
+    help='Score sheets from a JSON lines or CSV file and save them for the current stage. Each '
+         'sheet holds the team number in a "team" field and the answer to each task in a field '
+         'named as in the score form, e.g. "M01 - Space Travel-1". The whole file is checked '
+         'before any scores are saved and nothing is saved if there are any problems.')
+@click.argument('file', type=click.File(encoding='utf-8-sig'))
+def import_scores(file):
+    sheets, errors = read_sheets(file)
+    count, import_errors = _import_scores(sheets, save=not errors)
+    errors = sorted(errors + import_errors)
+
+    if errors:
+        for line_no, error in errors:
+            if line_no:
+                click.echo('ERROR: Line {:d}: {!s}'.format(line_no, error))
+            else:
+                click.echo('ERROR: {!s}'.format(error))
+
+        click.echo('No scores were imported.')
+        return
+
+    click.echo('{:d} scores imported.'.format(count))
+
+
 @app.cli.command('stage', short_help='Set the current stage.',
     help='Set the current stage. this is for advanced usage only and may cause issues if used '
          'during a live event. See the manual for when this should be used.')
@@ -172,8 +281,6 @@ def _set_stage(stage: int=None, no_confirm: bool=False):
     '''
     Helper for setting the stage.
     '''
-    stage_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', '.stage')
-
     while True:
         if stage is None:
             stage = click.prompt('Enter stage (0-4)', default='0')
@@ -184,20 +291,20 @@ def _set_stage(stage: int=None, no_confirm: bool=False):
             click.echo('Invalid value for stage: {!s}'.format(stage))
             continue
 
-        stages = ('round_1', 'round_2', 'quarter_final', 'semi_final', 'final')
-        stage_txt = stages[stage]
+        competition_format = current_format()
 
-        if app.config['LEGO_APP_TYPE'] == 'bristol' and stage == 1:
-            click.echo('Round 2 is only available during UK final.\n'
-                       'If this is not an error, please change your config.py and try again.')
+        if not competition_format.is_used(stage):
+            click.echo('Stage {:d} is not used by the {!s} format.\n'
+                       'If this is not an error, please change your config.py and try again.'
+                       .format(stage, competition_format.name))
             raise click.Abort()
 
-        click.echo('You have chosen {!s} ({!s}).'.format(stage_txt, stage))
+        click.echo('You have chosen {!s} ({!s}).'
+                   .format(competition_format.stage_name(stage), stage))
 
         if no_confirm or click.confirm('Is this correct?'):
             try:
-                with open(stage_file_path, 'w') as fh:
-                    fh.write(str(stage))
+                app.save_stage(stage)
             except IOError as e:
                 click.echo('Could not save stage to file. ({!s})'.format(e))
                 raise click.Abort()
@@ -206,6 +313,203 @@ def _set_stage(stage: int=None, no_confirm: bool=False):
             return
 
 
+@app.cli.command('upgrade-db', short_help='Upgrade the database.',
+    help='Upgrade a database created by an older version of the application to the current '
+         'schema. Back up the database before running this.')
+def upgrade_db():
+    path = db.engine.url.database
+
+    if not path or path == ':memory:':
+        click.echo('Only SQLite database files can be upgraded.')
+        return
+
+    db.session.remove()
+    db.engine.dispose()
+
+    applied = upgrade(path)
+    db.create_all()
+    leaderboard.invalidate()
+
+    for description in applied:
+        click.echo(description)
+
+    click.echo('Database is up to date.')
+
+
+@app.cli.command('serve', short_help='Run the application with several worker processes.',
+    help='Run the application for the event days. Each worker process handles requests with '
+         'several threads and is restarted if it exits. Stop with Ctrl+C.')
+@click.option('--host', default='0.0.0.0', help='The address to listen on.')
+@click.option('--port', default=5000, help='The port to listen on.')
+@click.option('--workers', default=os.cpu_count() or 2, help='The number of worker processes.')
+def serve(host: str, port: int, workers: int):
+    if workers < 1:
+        raise click.BadParameter('There must be at least one worker.', param_hint='--workers')
+
+    try:
+        run_server(host, port, workers)
+    except (OSError, RuntimeError) as exc:
+        raise click.ClickException(str(exc))
+
+
+@app.cli.command('load-test', short_help='Load test the application.',
+    help='Start the application against a temporary database and simulate scoreboard displays, '
+         'top ten screens and judges submitting scores, then report the throughput and response '
+         'times of each route. The real database is not used.')
+@click.option('--duration', default=60.0, help='How long to run for, in seconds.')
+@click.option('--interval', default=5.0,
+              help='How long each display or judge waits between requests, in seconds.')
+@click.option('--scoreboards', default=10, help='The number of scoreboard displays.')
+@click.option('--top-tens', default=5, help='The number of top ten screens.')
+@click.option('--judges', default=4, help='The number of judges.')
+@click.option('--teams', default=60, help='The number of teams.')
+@click.option('--workers', default=0,
+              help='Run the application with this many workers using serve, rather than run.')
+@click.option('--json', 'as_json', is_flag=True, help='Output the results as JSON.')
+def load_test(duration: float, interval: float, scoreboards: int, top_tens: int, judges: int,
+              teams: int, workers: int, as_json: bool):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            results = run_load_test(tmp_dir, duration, interval, scoreboards, top_tens, judges,
+                                    teams, workers)
+        except RuntimeError as exc:
+            raise click.ClickException(str(exc))
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+
+    click.echo('  {:<36} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8}'
+               .format('Route', 'Requests', 'Errors', 'Req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+
+    for r in results['routes']:
+        click.echo('  {route:<36} {requests:>8d} {errors:>6d} {per_second:>8.1f} {p50:>8.1f} '
+                   '{p95:>8.1f} {p99:>8.1f}'.format(**r))
+
+
+@app.cli.command('bench', short_help='Benchmark the ranking, scoring and rendering functions.',
+    help='Time the functions used to rank, score and display teams against generated teams at '
+         'each size and stage, reporting the best and median times. Use --json to save the '
+         'results for comparing with a later run.')
+@click.option('--size', 'sizes', type=int, multiple=True,
+              help='A number of teams to benchmark with, can be given more than once. '
+                   'Defaults to {!s}.'.format(', '.join(str(s) for s in SIZES)))
+@click.option('--stage', 'stages', type=click.IntRange(0, 4), multiple=True,
+              help='A stage to benchmark at, can be given more than once. Defaults to all stages.')
+@click.option('--repeat', default=5, help='How many times to time each benchmark.')
+@click.option('--budget', default=BUDGET,
+              help='Stop repeating a benchmark after this many seconds.')
+@click.option('--only', 'names', type=click.Choice([b[0] for b in BENCHMARKS]), multiple=True,
+              help='A benchmark to run, can be given more than once. Defaults to all benchmarks.')
+@click.option('--json', 'as_json', is_flag=True, help='Output the results as JSON.')
+def bench(sizes: tuple, stages: tuple, repeat: int, budget: float, names: tuple, as_json: bool):
+    def progress(r):
+        stage = '-' if r['stage'] is None else r['stage']
+        click.echo('  {:<26} {:>6d} {:>5} {:>11.3f} {:>11.3f} {:>11.3f}'
+                   .format(r['name'], r['teams'], stage, r['best_ms'], r['median_ms'],
+                           r['per_team_us']))
+
+    if not as_json:
+        click.echo('  {:<26} {:>6} {:>5} {:>11} {:>11} {:>11}'
+                   .format('Benchmark', 'Teams', 'Stage', 'Best ms', 'Median ms', 'Per team us'))
+
+    results = run_benchmarks(sizes or SIZES, stages or STAGES, repeat, budget, names,
+                             None if as_json else progress)
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+
+
+@app.cli.command('bench-db', short_help='Benchmark concurrent database reads and writes.',
+    help='Benchmark concurrent reads and writes against a temporary SQLite database, once with '
+         'the SQLite defaults and once with the SQLITE_* settings from config.py. Readers load '
+         'every team as the scoreboard does while writers update scores as judges do.')
+@click.option('--seconds', default=5.0, help='How long to run each benchmark for.')
+@click.option('--readers', default=8, help='The number of concurrent readers.')
+@click.option('--writers', default=2, help='The number of concurrent writers.')
+@click.option('--teams', default=100, help='The number of teams in the database.')
+def bench_db(seconds: float, readers: int, writers: int, teams: int):
+    runs = (('SQLite defaults', []), ('config.py settings', get_pragmas(app.config)))
+
+    for label, pragmas in runs:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = _bench_db(os.path.join(tmp_dir, 'bench.db'), pragmas, seconds, readers,
+                                writers, teams)
+
+        click.echo('{!s}: {!s}'.format(label, ', '.join('{!s}={!s}'.format(*p) for p in pragmas)
+                                                 or 'none'))
+
+        for kind in ('read', 'write'):
+            r = results[kind]
+            click.echo('  {:<5}  {:>8.1f} ops/s  max {:>7.1f} ms  errors {:d}'
+                       .format(kind, r['count'] / seconds, r['max'] * 1000, r['errors']))
+
+
+def _bench_db(path: str, pragmas: list, seconds: float, readers: int, writers: int,
+              teams: int) -> dict:
+    '''
+    Helper for running a single database benchmark.
+    '''
+    con = sqlite3.connect(path)
+    apply_pragmas(con, pragmas)
+    con.execute('CREATE TABLE team (id INTEGER PRIMARY KEY, number INTEGER, name VARCHAR(80), '
+                'active BOOLEAN)')
+    con.execute('CREATE TABLE score (id INTEGER PRIMARY KEY, team_id INTEGER, stage INTEGER, '
+                'attempt INTEGER, total INTEGER, breakdown VARCHAR, '
+                'UNIQUE (team_id, stage, attempt))')
+    con.executemany('INSERT INTO team VALUES (?, ?, ?, 1)',
+                    [(i, i, 'Team {:d}'.format(i)) for i in range(1, teams + 1)])
+    con.commit()
+    con.close()
+
+    results = {k: {'count': 0, 'max': 0.0, 'errors': 0} for k in ('read', 'write')}
+    lock = threading.Lock()
+    stop = time.time() + seconds
+
+    def read(con):
+        con.execute('SELECT * FROM team WHERE active = 1').fetchall()
+        con.execute('SELECT team_id, stage, attempt, total FROM score').fetchall()
+
+    def write(con):
+        con.execute('INSERT OR REPLACE INTO score (team_id, stage, attempt, total, breakdown) '
+                    'VALUES (?, 0, 1, ?, ?)', (randint(1, teams), randint(0, 400), 'x' * 200))
+        con.commit()
+
+    def worker(kind, op):
+        while time.time() < stop:
+            start = time.time()
+
+            # a new connection per operation, as the application does for each request
+            try:
+                con = sqlite3.connect(path)
+                apply_pragmas(con, pragmas)
+                op(con)
+                con.close()
+            except sqlite3.OperationalError:
+                error = 1
+            else:
+                error = 0
+
+            elapsed = time.time() - start
+
+            with lock:
+                r = results[kind]
+                r['count'] += 1 - error
+                r['errors'] += error
+                r['max'] = max(r['max'], elapsed)
+
+    threads = [threading.Thread(target=worker, args=('read', read)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=('write', write)) for _ in range(writers)]
+
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    return results
+
+
 @app.cli.command('simulate', short_help='Simulate a run through the comptition.',
     help='Simulate a run through the competition. Will pause at the end of each round. '
          'WARNING: This will remove any existing teams from the database.')
@@ -213,6 +517,7 @@ def simulate():
     # empty the teams first
     click.echo('Resetting teams')
     Team.query.filter_by(is_practice=False).delete()
+    rebuild_mission_stats()
     db.session.commit()
 
     # add teams from example file
@@ -227,54 +532,25 @@ def simulate():
 
     teams = Team.query.filter_by(is_practice=False, active=True).all()
 
-    # round 1
-    for _ in range(3):
-        for t in teams:
-            t.set_score((randint(0, 20) * 10,""))
-
-        db.session.commit()
-        click.pause()
+    competition_format = current_format()
 
-    # round 2
-    if app.config['LEGO_APP_TYPE'] == 'uk':
-        _set_stage(1, True)
-        set_active_teams(1)
-        teams = Team.query.filter_by(is_practice=False, active=True).all()
+    for stage in competition_format.stages:
+        if stage.number:
+            _set_stage(stage.number, True)
+            set_active_teams(stage.number)
+            teams = Team.query.filter_by(is_practice=False, active=True).all()
 
-        for t in teams:
-            t.set_score((randint(0, 20) * 10,""))
-
-        db.session.commit()
-        click.pause()
-
-    _set_stage(2, True)
-    set_active_teams(2)
-    teams = Team.query.filter_by(is_practice=False, active=True).all()
-
-    # quarter + semi
-    for i in range(2):
-        for t in teams:
-            t.set_score((randint(0, 20) * 10,""))
-
-        db.session.commit()
-        click.pause()
-
-        _set_stage(3 + i, True)
-        set_active_teams(3 + i)
-        teams = Team.query.filter_by(is_practice=False, active=True).all()
-
-    # final
-    for i in range(2):
-        for t in teams:
-            t.set_score((randint(0, 20) * 10,""))
-
-        db.session.commit()
-        click.pause()
+        for _ in range(stage.attempts):
+            for t in teams:
+                t.set_score((randint(0, 20) * 10,""))
 
+            db.session.commit()
+            click.pause()
 
     # remove the used teams
     click.echo('Resetting teams')
     Team.query.filter_by(is_practice=False).delete()
+    rebuild_mission_stats()
     db.session.commit()
 
     click.echo('Complete!')
@@ -4,25 +4,30 @@
 # See the manual for what these do.
 # -----------------------------------------------------------------------------
 
-from os import path
+from os import environ, path
 
 # ----------------
 # Helper functions
 # ----------------
 def db_uri() -> str:
     '''
-    Generate the path for the database file.
+    Generate the path for the database file. Set the LEGO_DATABASE environment variable to the path
+    of a file to use a different database, e.g. a copy for testing.
     '''
     cur_dir = path.dirname(path.abspath(__file__))
-    db_dir = path.join(cur_dir, 'tmp')
+    db_file = environ.get('LEGO_DATABASE') or path.join(cur_dir, 'tmp', 'app.db')
 
-    # TODO: make this configurable via env vars
-    if True:
-        db_file = 'app.db'
-    else:
-        db_file = 'test.db'
+    return 'sqlite:///' + path.abspath(db_file)
 
-    return 'sqlite:///' + path.join(db_dir, db_file)
+
+def stage_path() -> str:
+    '''
+    Generate the path for the file holding the current stage. Set the LEGO_STAGE environment
+    variable to use a different file.
+    '''
+    cur_dir = path.dirname(path.abspath(__file__))
+
+    return path.abspath(environ.get('LEGO_STAGE') or path.join(cur_dir, 'tmp', '.stage'))
 
 # ----------------
 # Default settings
@@ -30,9 +35,71 @@ def db_uri() -> str:
 WTF_CSRF_ENABLED = True
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 SQLALCHEMY_DATABASE_URI = db_uri()
+STAGE_PATH = stage_path()
+
+# SQLite connection settings, applied to every connection. Set any of these to None to use the
+# SQLite default instead.
+# Write-ahead logging allows the scoreboards to read while judges are submitting scores.
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_SYNCHRONOUS = 'NORMAL'
+# How long to wait for a lock, in milliseconds, before failing with "database is locked".
+SQLITE_BUSY_TIMEOUT = 5000
+# Page cache size. Negative values are in KiB, so -16000 is roughly 16 MB.
+SQLITE_CACHE_SIZE = -16000
+# Memory-mapped I/O size in bytes.
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024
+
+# Record request, SQL and template timings, shown at /admin/metrics.
+METRICS_ENABLED = True
+
+# Logging. LOG_FORMAT is 'json' for a JSON object per line or 'text'.
+LOG_LEVEL = 'INFO'
+LOG_FORMAT = 'json'
+# The fraction of successful requests to the scoreboards, the top ten, the leaderboard stream and
+# API, and static files which are logged. The scoreboards refresh constantly, so logging every
+# request fills the log with little of use. Requests to other pages, and errors, are always logged.
+# Set LOG_SAMPLED_ENDPOINTS to sample a different set of endpoints, e.g.
+#
+# LOG_SAMPLED_ENDPOINTS = ('scoreboard', 'top_ten', 'scoreboard_stream', 'static')
+LOG_SAMPLE_RATE = 0.1
+
+# How long, in seconds, a logged in user is kept in memory before being loaded from the database
+# again. Set to 0 to load them on every request.
+USER_CACHE_TTL = 60
 
 # ---------------------
 # Customisable settings
 # ---------------------
 SECRET_KEY = 'your-secret-key'
 LEGO_APP_TYPE = 'bristol'
+
+# The competition formats LEGO_APP_TYPE can be set to. Each has a scoreboard layout ('bristol' or
+# 'uk') and an entry per stage 0-4, or None for a stage it skips. A stage has a name, the number of
+# attempts each team gets (at most 3 in the first round and 1 after) and the number of teams that
+# go through to it (cutoff). These are added to the built in bristol and uk formats, replacing
+# them if they have the same name, so only new or changed formats need adding, e.g.
+#
+# COMPETITION_FORMATS = {
+#     'regional': {
+#         'layout': 'uk',
+#         'stages': [
+#             {'name': 'First Round', 'attempts': 2},
+#             None,
+#             None,
+#             None,
+#             {'name': 'Final', 'cutoff': 3},
+#         ],
+#     },
+# }
+COMPETITION_FORMATS = {}
+
+# Events to host side by side, each served under /e/<name>/ with its own database, stage file and
+# competition format. When empty a single event is served using the settings above. Each event has
+# a database path, and optionally a stage file path (defaults to the database path followed by
+# .stage), an app_type (defaults to LEGO_APP_TYPE) and a title for the list of events, e.g.
+#
+# EVENTS = {
+#     'north': {'database': '/srv/lego/north.db', 'app_type': 'uk', 'title': 'North Qualifier'},
+#     'south': {'database': '/srv/lego/south.db', 'title': 'South Qualifier'},
+# }
+EVENTS = {}
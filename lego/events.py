@@ -0,0 +1,217 @@
+# -----------------------------------------------------------------------------
+# Hosting several events from one application.
+#
+# Each event in the EVENTS config setting is served under its own URL prefix,
+# e.g. /e/north/scoreboard/, and has its own database, stage file, leaderboard
+# and competition format. An event's database engine is created the first time
+# the event is used. Without EVENTS, a single event is served at the root using
+# SQLALCHEMY_DATABASE_URI, STAGE_PATH and LEGO_APP_TYPE as before.
+#
+# CLI commands use the event named by the LEGO_EVENT environment variable, e.g.
+# `LEGO_EVENT=north flask init`.
+# -----------------------------------------------------------------------------
+
+from collections import OrderedDict
+import os
+import re
+
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, _EngineConnector, get_state
+
+from lego import app, util
+
+
+__all__ = ['Event', 'EventDispatcher', 'EventSQLAlchemy', 'events', 'current_event',
+           'current_name', 'stage_store', 'load_stage', 'save_stage', 'PREFIX']
+
+# the start of the path of every page of an event, followed by its name
+PREFIX = '/e/'
+
+# the WSGI environ key holding the name of the event a request is for
+ENVIRON_KEY = 'lego.event'
+
+# the environment variable naming the event for CLI commands
+EVENT_VARIABLE = 'LEGO_EVENT'
+
+_NAME_RE = re.compile(r'^[a-z0-9][a-z0-9_-]*$')
+
+
+class Event(object):
+    '''
+    An event hosted by the application.
+    '''
+
+    def __init__(self, name: str, database: str, stage: str=None, app_type: str=None,
+                 title: str=None):
+        '''
+        :param name: The name used in the event's URLs, in lower case letters, numbers, `-` and `_`.
+        :param database: The path to the event's SQLite database.
+        :param stage: The path to the file holding the event's stage. Defaults to the database path
+            followed by `.stage`.
+        :param app_type: The competition format, as for `LEGO_APP_TYPE`. Defaults to
+            `LEGO_APP_TYPE`.
+        :param title: The name of the event shown on the list of events. Defaults to the name.
+
+        :raises ValueError: If the name or database is invalid.
+        '''
+        if not _NAME_RE.match(name or ''):
+            raise ValueError('Event {!r}: names can only contain lower case letters, numbers, - '
+                             'and _'.format(name))
+
+        if not database:
+            raise ValueError('Event {!s}: a database must be given'.format(name))
+
+        self.name = name
+        self.database = os.path.abspath(database)
+        self.stage_store = util.StageStore(os.path.abspath(stage or self.database + '.stage'))
+        self.app_type = app_type or app.config['LEGO_APP_TYPE']
+        self.title = title or name
+
+    @property
+    def uri(self) -> str:
+        return 'sqlite:///' + self.database
+
+    @property
+    def prefix(self) -> str:
+        return PREFIX + self.name
+
+    def __repr__(self):
+        return '<Event name={!r}, database={!r}>'.format(self.name, self.database)
+
+
+def load_events(config: dict) -> OrderedDict:
+    '''
+    Build the events from their config.
+
+    :param config: A dict per event name holding the `Event` arguments other than the name.
+
+    :return: An `Event` per name, in the order given.
+
+    :raises ValueError: If an event is invalid.
+    '''
+    return OrderedDict((name, Event(name, **spec)) for name, spec in config.items())
+
+
+events = load_events(app.config.get('EVENTS') or {})
+
+
+def current_name() -> str:
+    '''
+    Get the name of the event being handled: the event a request is for, otherwise the event named
+    by `LEGO_EVENT`.
+
+    :return: The name, or None if serving a single event or the request isn't for an event.
+    '''
+    if has_request_context():
+        return request.environ.get(ENVIRON_KEY)
+
+    return os.environ.get(EVENT_VARIABLE) or None
+
+
+def current_event() -> Event:
+    '''
+    Get the event being handled, see `current_name`.
+
+    :return: The event, or None if serving a single event or the request isn't for an event.
+
+    :raises ValueError: If `LEGO_EVENT` names an event that doesn't exist.
+    '''
+    name = current_name()
+
+    if name is None:
+        return None
+
+    try:
+        return events[name]
+    except KeyError:
+        raise ValueError('Unknown event: {!s}. Check {!s} and EVENTS in config.py.'
+                         .format(name, EVENT_VARIABLE))
+
+
+def stage_store() -> util.StageStore:
+    '''
+    Get the stage file of the event being handled, or `STAGE_PATH` if serving a single event.
+    '''
+    event = current_event()
+
+    return event.stage_store if event else util.stage_store
+
+
+def load_stage() -> int:
+    '''
+    Load the current stage of the event being handled. See `util.load_stage`.
+    '''
+    return stage_store().load()
+
+
+def save_stage(stage: int):
+    '''
+    Save the current stage of the event being handled. See `util.save_stage`.
+    '''
+    stage_store().save(stage)
+
+
+class EventDispatcher(object):
+    '''
+    WSGI middleware which moves an event's prefix from the path to the script name, so the routes
+    match as for a single event and `url_for` builds URLs within the event.
+    '''
+
+    def __init__(self, wsgi_app, events: dict):
+        '''
+        :param wsgi_app: The application to dispatch to.
+        :param events: The events, keyed by name.
+        '''
+        self.wsgi_app = wsgi_app
+        self.events = events
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+
+        if path.startswith(PREFIX):
+            name, _, rest = path[len(PREFIX):].partition('/')
+
+            if name in self.events:
+                environ[ENVIRON_KEY] = name
+                environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + PREFIX + name
+                environ['PATH_INFO'] = '/' + rest
+
+        return self.wsgi_app(environ, start_response)
+
+
+class _EventConnector(_EngineConnector):
+    '''
+    Creates the engine for an event's database.
+    '''
+
+    def __init__(self, sa, app, event: Event):
+        super(_EventConnector, self).__init__(sa, app)
+        self._event = event
+
+    def get_uri(self):
+        return self._event.uri
+
+
+class EventSQLAlchemy(SQLAlchemy):
+    '''
+    Flask-SQLAlchemy using the database of the event being handled, see `current_event`. Each
+    event's engine is created the first time it is used and kept for the life of the process.
+    '''
+
+    def get_engine(self, app=None, bind=None):
+        event = current_event() if bind is None else None
+
+        if event is None:
+            return super(EventSQLAlchemy, self).get_engine(app, bind)
+
+        app = self.get_app(app)
+        state = get_state(app)
+        key = (ENVIRON_KEY, event.name)
+
+        with self._engine_lock:
+            connector = state.connectors.get(key)
+
+            if connector is None:
+                connector = state.connectors[key] = _EventConnector(self, app, event)
+
+        return connector.get_engine()
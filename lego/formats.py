@@ -0,0 +1,190 @@
+# -----------------------------------------------------------------------------
+# Competition formats.
+#
+# A format names the stages an event runs through, the number of attempts teams
+# get in each and the number of teams that go through to each. Formats are
+# defined as data in the COMPETITION_FORMATS config setting and chosen with
+# LEGO_APP_TYPE, so adding a format only needs a change to config.py.
+#
+# Stages are numbered 0-4 as the scores are stored, see lego.models.score. A
+# format can skip any stage but the first, e.g. the Bristol final has no second
+# round.
+# -----------------------------------------------------------------------------
+
+from collections import namedtuple
+
+from lego import app
+from lego.events import current_event
+from lego.models.score import STAGE_ATTEMPTS
+
+
+__all__ = ['Format', 'Stage', 'DEFAULT_FORMATS', 'LAYOUTS', 'current_format', 'load_formats']
+
+# the scoreboard layouts, each with its own template
+LAYOUTS = ('bristol', 'uk')
+
+# the formats used when config.py doesn't define them, as in older config.py files
+DEFAULT_FORMATS = {
+    'bristol': {
+        'layout': 'bristol',
+        'stages': [
+            {'name': 'First Round', 'attempts': 3},
+            None,
+            {'name': 'Quarter Final', 'cutoff': 6},
+            {'name': 'Semi Final', 'cutoff': 4},
+            {'name': 'Final', 'cutoff': 2},
+        ],
+    },
+    'uk': {
+        'layout': 'uk',
+        'stages': [
+            {'name': 'First Round', 'attempts': 3},
+            {'name': 'Second Round', 'cutoff': 12},
+            {'name': 'Quarter Final', 'cutoff': 8},
+            {'name': 'Semi Final', 'cutoff': 4},
+            {'name': 'Final', 'cutoff': 2},
+        ],
+    },
+}
+
+# a stage used by a format. The cutoff is the number of teams going through to the stage, or None
+# if every active team does
+Stage = namedtuple('Stage', ('number', 'name', 'attempts', 'cutoff'))
+
+
+class Format(object):
+    '''
+    The stages used by an event and how teams progress through them.
+    '''
+
+    def __init__(self, name: str, layout: str, stages: list):
+        '''
+        :param name: The name of the format, as used for `LEGO_APP_TYPE`.
+        :param layout: The scoreboard layout, one of `LAYOUTS`.
+        :param stages: A dict per stage number holding the stage's `name`, and optionally its
+            number of `attempts` (defaults to the most the stage can have) and `cutoff`. None for a
+            stage the format doesn't use. Missing stages at the end are not used.
+
+        :raises ValueError: If the format is invalid.
+        '''
+        if layout not in LAYOUTS:
+            raise ValueError('Format {!s}: layout must be one of {!s}'
+                             .format(name, ', '.join(LAYOUTS)))
+
+        if len(stages) > len(STAGE_ATTEMPTS):
+            raise ValueError('Format {!s}: at most {:d} stages are supported'
+                             .format(name, len(STAGE_ATTEMPTS)))
+
+        if not stages or not stages[0]:
+            raise ValueError('Format {!s}: the first stage must be used'.format(name))
+
+        self.name = name
+        self.layout = layout
+        self._stages = [None] * len(STAGE_ATTEMPTS)
+
+        for number, spec in enumerate(stages):
+            if spec:
+                self._stages[number] = _build_stage(name, number, spec)
+
+    @property
+    def stages(self) -> list:
+        '''
+        The stages used, in order.
+        '''
+        return [s for s in self._stages if s is not None]
+
+    def stage(self, number: int) -> Stage:
+        '''
+        Get a stage by its number.
+
+        :return: The stage, or None if the format doesn't use it.
+        '''
+        if 0 <= number < len(self._stages):
+            return self._stages[number]
+
+        return None
+
+    def stage_name(self, number: int) -> str:
+        '''
+        Get the name of a stage, or a placeholder if the format doesn't use it, e.g. if the stage
+        was set for another format.
+        '''
+        stage = self.stage(number)
+
+        return stage.name if stage else 'Stage {:d} (not used)'.format(number)
+
+    def is_used(self, number: int) -> bool:
+        return self.stage(number) is not None
+
+    def attempts(self, number: int) -> int:
+        '''
+        Get the number of attempts teams get in a stage, 0 if the format doesn't use it.
+        '''
+        stage = self.stage(number)
+
+        return stage.attempts if stage else 0
+
+    def cutoff(self, number: int):
+        '''
+        Get the number of teams going through to a stage, or None if every active team does.
+        '''
+        stage = self.stage(number)
+
+        return stage.cutoff if stage else None
+
+    def __repr__(self):
+        return '<Format name={!r}, layout={!r}>'.format(self.name, self.layout)
+
+
+def _build_stage(format_name: str, number: int, spec: dict) -> Stage:
+    '''
+    Build and check a stage from its config.
+    '''
+    if not spec.get('name'):
+        raise ValueError('Format {!s}: stage {:d} must have a name'.format(format_name, number))
+
+    attempts = spec.get('attempts', STAGE_ATTEMPTS[number])
+    cutoff = spec.get('cutoff')
+
+    if not isinstance(attempts, int) or not 1 <= attempts <= STAGE_ATTEMPTS[number]:
+        raise ValueError('Format {!s}: stage {:d} must have between 1 and {:d} attempts'
+                         .format(format_name, number, STAGE_ATTEMPTS[number]))
+
+    if cutoff is not None and (number == 0 or not isinstance(cutoff, int) or cutoff < 1):
+        raise ValueError('Format {!s}: stage {:d} cutoff must be a positive number, or None for '
+                         'the first stage'.format(format_name, number))
+
+    return Stage(number, spec['name'], attempts, cutoff)
+
+
+def load_formats(config: dict) -> dict:
+    '''
+    Build the formats from their config.
+
+    :param config: The formats keyed by name, as in `DEFAULT_FORMATS`.
+
+    :return: A `Format` per name.
+
+    :raises ValueError: If a format is invalid.
+    '''
+    return {name: Format(name, spec.get('layout'), spec.get('stages') or [])
+            for name, spec in config.items()}
+
+
+def current_format() -> Format:
+    '''
+    Get the format chosen with `LEGO_APP_TYPE`, or by the event being handled.
+
+    :raises ValueError: If there is no format with that name.
+    '''
+    event = current_event()
+    name = event.app_type if event else app.config['LEGO_APP_TYPE']
+
+    try:
+        return formats[name]
+    except KeyError:
+        raise ValueError('Unsupported value for LEGO_APP_TYPE: {!s}'.format(name))
+
+
+# formats in config.py are added to the defaults, replacing any with the same name
+formats = load_formats(dict(DEFAULT_FORMATS, **app.config.get('COMPETITION_FORMATS', {})))
@@ -9,4 +9,6 @@ from lego.forms.new_team_form import NewTeamForm
 from lego.forms.edit_team_score_form import EditTeamScoreForm
 from lego.forms.reset_team_score_form import ResetTeamScoreForm
 from lego.forms.stage_form import StageForm
-from lego.forms.manage_active_teams_form import generate_manage_active_teams_form
+from lego.forms.import_scores_form import ImportScoresForm
+from lego.forms.manage_active_teams_form import generate_manage_active_teams_form, \
+    apply_manage_active_teams_form
@@ -0,0 +1,12 @@
+# -----------------------------------------------------------------------------
+# A form for importing score sheets from a file.
+# -----------------------------------------------------------------------------
+
+from flask_wtf import FlaskForm
+from wtforms import FileField
+from wtforms.validators import DataRequired
+
+
+class ImportScoresForm(FlaskForm):
+    sheets = FileField('Score sheets (JSON lines or CSV):',
+                       validators=[DataRequired(message='Please select a file.')])
@@ -1,21 +1,74 @@
 # -----------------------------------------------------------------------------
-# A form for moving up the stages.
+# A form for setting which teams are active.
+#
+# The form has a field per team, so its class is generated from the teams. The
+# class is cached until a team is added or removed, and the current active
+# flags are passed as the form's data rather than baked into the class.
 # -----------------------------------------------------------------------------
 
 from flask_wtf import FlaskForm
 from wtforms import BooleanField
 
+from lego import db
 from lego.models import Team
+from lego.util import LRUCache
+
+
+# the generated form classes, keyed by the ids of the teams they are for
+_form_classes = LRUCache(4)
+
+
+def field_name(team_id: int) -> str:
+    return str(team_id) + '_active'
+
+
+def _form_class(team_ids: tuple):
+    form_class = _form_classes.get(team_ids)
+
+    if form_class is None:
+        fields = {field_name(i): BooleanField('Active') for i in team_ids}
+        form_class = type('ManageActiveTeamsForm', (FlaskForm,), fields)
+        _form_classes.set(team_ids, form_class)
+
+    return form_class
 
 
 def generate_manage_active_teams_form():
-    class ManageActiveTeamsForm(FlaskForm):
-        pass
+    '''
+    Build the form for the current teams, excluding the practice team.
 
-    form = ManageActiveTeamsForm
-    form.teams = Team.query.filter_by(is_practice=False).order_by('number ASC').all()
+    :return: The form, with the teams' ids, numbers, names and active flags in `teams`.
+    '''
+    teams = db.session.query(Team.id, Team.number, Team.name, Team.active) \
+        .filter_by(is_practice=False).order_by(Team.number).all()
+
+    form_class = _form_class(tuple(t.id for t in teams))
+    form = form_class(data={field_name(t.id): t.active for t in teams})
+    form.teams = teams
+
+    return form
+
+
+def apply_manage_active_teams_form(form) -> int:
+    '''
+    Save the active flags submitted in the form, updating only the teams which have changed with a
+    bulk update for each value. The caller commits.
+
+    :param form: A validated form from `generate_manage_active_teams_form`.
+
+    :return: The number of teams changed.
+    '''
+    changed = {True: [], False: []}
 
     for t in form.teams:
-        setattr(form, str(t.id) + '_active', BooleanField('Active', default=t.active))
+        active = bool(form[field_name(t.id)].data)
+
+        if active != t.active:
+            changed[active].append(t.id)
+
+    for active, ids in changed.items():
+        if ids:
+            Team.query.filter(Team.id.in_(ids)) \
+                .update({Team.active: active}, synchronize_session=False)
 
-    return form()
+    return len(changed[True]) + len(changed[False])
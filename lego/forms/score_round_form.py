@@ -13,25 +13,12 @@ import json
 import os
 from collections import OrderedDict
 
+from lego.breakdowns import BreakdownCodec
+from lego.scoring import ScoringProgram
 
-class ScoredFormField(FormField):
-    """ extension to the FormField class to allow the form to generate a score based on the fields it contains """
-    def score(self):
-        score = 0
-
-        for _, task in self._fields.items():
-            if isinstance(task, StringField):
-                # strings do not carry any score
-                continue
-            elif isinstance(task, BooleanField):
-                if task.data is False:
-                    return 0
-            elif isinstance(task, ScoredFormField):
-                score += task.score()
-            else:
-                score += int(task.data)
 
-        return score
+class ScoredFormField(FormField):
+    """ FormField holding the tasks of a single mission, scored by `program` """
 
 
 class CheckboxField(Field):
@@ -66,6 +53,22 @@ field_classes = {
 }
 
 
+MISSIONS_PATH = os.path.join(os.path.dirname(__file__), '..', 'missions.json')
+
+
+# the compiled missions used to score submitted forms
+program = ScoringProgram.from_json(MISSIONS_PATH)
+
+# stores the breakdowns of the scores for the missions
+codec = BreakdownCodec(program.missions)
+
+
+def mission_names(path=MISSIONS_PATH):
+    """ returns the mission names in the order they are scored """
+    with open(path) as fh:
+        return sorted(json.load(fh).keys())
+
+
 def parse_json(path):
     """ parses json file and generates a FieldList full of FieldLists for all the missions """
     json_data = json.load(open(path))
@@ -102,20 +105,15 @@ class ScoreRoundForm(FlaskForm):
     confirm = HiddenField(default='0')
     score = IntegerField('Total score', validators=[Optional()])
 
-    missions = parse_json(os.path.dirname(__file__) + '/../missions.json')
+    missions = parse_json(MISSIONS_PATH)
 
-    def points_scored(self) -> (int, str):
-        """Calculate the points scored for this round."""
-        score_breakdown = OrderedDict()
-        # protected field '_fields' used due to dynamic generation defining the field names at runtime
-        for mission_name, mission in self.missions.form._fields.items():
-            score_breakdown[mission_name] = mission.score()
-
-        score = sum(score_breakdown.values())
+    def process(self, formdata=None, obj=None, data=None, **kwargs):
+        """Keeps the submitted data so it can be scored without walking the fields."""
+        self.formdata = self.meta.wrap_formdata(self, formdata)
+        super(ScoreRoundForm, self).process(self.formdata, obj, data, **kwargs)
 
-        # ensure score is not less than 0
-        if score < 0:
-            score = 0
-        score_breakdown = str(score_breakdown)
+    def points_scored(self) -> (int, str):
+        """Calculate the points scored for this round and the breakdown to store."""
+        score, score_breakdown = program.score(self.formdata or {}, prefix=self.missions.name + '-')
 
-        return score, score_breakdown
+        return score, codec.encode(score_breakdown)
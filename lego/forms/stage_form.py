@@ -8,10 +8,5 @@ from wtforms.validators import Optional
 
 
 class StageForm(FlaskForm):
-    stage = SelectField('Move to stage:',
-                        choices=[('0', 'First Round'),
-                                 ('1', 'Second Round (UK Final only)'),
-                                 ('2', 'Quarter Final'),
-                                 ('3', 'Semi Final'),
-                                 ('4', 'Final')],
-                        validators=[Optional()])
+    # the choices are the stages of the competition format, set when the form is created
+    stage = SelectField('Move to stage:', choices=[], validators=[Optional()])
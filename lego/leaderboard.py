@@ -0,0 +1,416 @@
+# -----------------------------------------------------------------------------
+# A materialised leaderboard shared by the scoreboards and judges pages.
+#
+# The ranked teams are built once and kept in memory until a write to the
+# teams is committed or the stage changes, so a scoreboard request only has to
+# render the precomputed order. Pages showing only a few teams can instead
+# have the database rank the teams and return just the rows they show. Each
+# event has its own leaderboard, see lego.events.
+# -----------------------------------------------------------------------------
+
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import event, func
+from werkzeug.local import LocalProxy
+
+from lego import app, db, ranking
+from lego.events import current_name
+from lego.models import Score, Team
+from lego.models.score import SLOTS
+
+
+__all__ = ['Entry', 'Standings', 'Leaderboard', 'leaderboard']
+
+# the team columns needed to rank and display a team
+TEAM_COLUMNS = ('id', 'number', 'name', 'active')
+
+# the team columns followed by the score for each slot
+COLUMNS = TEAM_COLUMNS + tuple(SLOTS)
+
+# the columns sent to clients for each team, after its rank
+PUBLIC_COLUMNS = ('number', 'name', 'attempt_1', 'attempt_2', 'attempt_3', 'highest_score',
+                  'round_2', 'quarter', 'semi', 'final')
+
+# how long, in seconds, entity tags are given from the standings held in memory before checking the
+# stage and database for changes made by other processes
+ETAG_CHECK_INTERVAL = 1.0
+
+
+class Entry(object):
+    '''
+    A read-only snapshot of a team's display columns.
+
+    Provides the same attributes as a `Team` for use in the templates, without the score breakdowns
+    or a database session.
+    '''
+    __slots__ = COLUMNS + ('stage',)
+
+    def __init__(self, row, scores: dict, stage: int):
+        '''
+        :param row: The values of `TEAM_COLUMNS` for the team.
+        :param scores: The team's score totals keyed by slot name. Missing slots are set to None.
+        :param stage: The stage the team is being ranked for.
+        '''
+        for name, value in zip(TEAM_COLUMNS, row):
+            setattr(self, name, value)
+
+        for name in SLOTS:
+            setattr(self, name, scores.get(name))
+
+        self.stage = stage
+
+    def __repr__(self):
+        name = self.__class__.__name__
+        return '<{!s}(id={!r}, number={!r}, name={!r}>' \
+            .format(name, self.id, self.number, self.name)
+
+    @property
+    def attempts(self):
+        return [self.attempt_1, self.attempt_2, self.attempt_3]
+
+    @property
+    def best_attempt(self):
+        ret = max(self.attempt_1 or -1, self.attempt_2 or -1, self.attempt_3 or -1)
+        return None if ret == -1 else ret
+
+    @property
+    def round_1_total(self):
+        return sum([a or 0 for a in self.attempts])
+
+    @property
+    def highest_score(self):
+        return ranking.highest_score(self, self.stage)
+
+
+class Standings(object):
+    '''
+    The ranked teams for a single version of the leaderboard.
+
+    The version counts the changes seen by this process, so it differs between `flask serve`
+    workers. The entity tag is instead a hash of the stage and the ranked teams, so every worker
+    holding the same standings gives the same tag.
+    '''
+
+    def __init__(self, version: int, stage: int, teams: list):
+        '''
+        :param version: The leaderboard version these standings were built for.
+        :param stage: The stage the teams were ranked for.
+        :param teams: All non-practice teams, ranked from highest to lowest.
+        '''
+        self.version = version
+        self.stage = stage
+        self.teams = teams
+        self.active = [t for t in teams if t.active]
+        self.etag = _content_tag(stage, teams)
+
+    def to_dict(self, teams: list, offset: int=0) -> dict:
+        '''
+        Convert a ranked list of teams from these standings to a compact, JSON serialisable form.
+
+        :param teams: The teams to include, e.g. `teams`, `active` or a slice of either.
+        :param offset: The rank of the first team minus 1, for when a slice is passed.
+
+        :return: A dict holding the version, stage, column names and a list of values per team in
+            the same order as the column names.
+        '''
+        rows = []
+
+        for rank, team in enumerate(teams, start=offset + 1):
+            rows.append([rank] + [getattr(team, c) for c in PUBLIC_COLUMNS])
+
+        return {
+            'version': self.version,
+            'stage': self.stage,
+            'columns': ('rank',) + PUBLIC_COLUMNS,
+            'teams': rows,
+        }
+
+
+class Leaderboard(object):
+    '''
+    Keeps the ranked standings in memory and rebuilds them only when they are out of date.
+
+    The standings are invalidated when a session commits a change to a team. Changes made by other
+    processes, such as the CLI or other `flask serve` workers, are picked up by checking SQLite's
+    data version, and stage changes are picked up by comparing against the current stage. Any change
+    to the data version invalidates the standings, as checking which rows changed would mean loading
+    every team. Writes to other tables are rare during an event, and only cost a rebuild.
+
+    The teams are ranked by the database. The full standings are only built when needed, pages that
+    show a few teams can fetch just those using `page`.
+    '''
+
+    def __init__(self, listeners: list=None):
+        '''
+        :param listeners: The list to hold the functions registered with `add_listener`, which can
+            be shared between leaderboards.
+        '''
+        self.version = 0
+        self._standings = None
+        self._stage = None
+        self._signature = None
+        # when the stage and database were last checked, see `_check`
+        self._checked = None
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._listeners = [] if listeners is None else listeners
+
+    def get(self) -> Standings:
+        '''
+        Get the current standings, rebuilding them if necessary.
+
+        :return: The current standings.
+        '''
+        stage = self._check()
+        standings = self._standings
+
+        if standings is not None and standings.stage == stage:
+            return standings
+
+        with self._lock:
+            if self._standings is None or self._standings.stage != stage:
+                rows = db.session.execute(ranking.ranked_select(stage))
+                self._standings = Standings(self.version, stage, _build_entries(rows, stage))
+
+            return self._standings
+
+    def page(self, offset: int, limit: int, active_only: bool=True) -> list:
+        '''
+        Get a page of the ranked teams without building the full standings.
+
+        :param offset: The number of teams to skip.
+        :param limit: The maximum number of teams to return.
+        :param active_only: Only include active teams.
+
+        :return: The teams on the page.
+        '''
+        stage = self._check()
+        standings = self._standings
+
+        # nothing to load if the standings have already been built
+        if standings is not None and standings.stage == stage:
+            teams = standings.active if active_only else standings.teams
+            return teams[offset:offset + limit]
+
+        query = ranking.ranked_select(stage, active_only).limit(limit).offset(offset)
+        return _build_entries(db.session.execute(query), stage)
+
+    def count(self, active_only: bool=True) -> int:
+        '''
+        Count the ranked teams without building the full standings.
+
+        :param active_only: Only count active teams.
+
+        :return: The number of teams.
+        '''
+        stage = self._check()
+        standings = self._standings
+
+        if standings is not None and standings.stage == stage:
+            return len(standings.active if active_only else standings.teams)
+
+        query = db.session.query(func.count(Team.id)).filter(Team.is_practice == False)
+
+        if active_only:
+            query = query.filter(Team.active == True)
+
+        return query.scalar()
+
+    def current_version(self) -> int:
+        '''
+        Get the current version of the leaderboard. The standings are not built.
+
+        :return: The current version.
+        '''
+        self._check()
+        return self.version
+
+    def etag(self) -> str:
+        '''
+        Get the entity tag of the current standings, see `Standings`. The tag is read from the
+        standings held in memory so answering a conditional request doesn't touch the database.
+        Changes committed in this process are seen straight away, while the stage and changes made
+        by other processes are checked for at most once every `ETAG_CHECK_INTERVAL` seconds. The
+        standings are built if they are out of date.
+
+        :return: The entity tag.
+        '''
+        checked = self._checked
+        standings = self._standings
+
+        if checked is None or time.monotonic() - checked >= ETAG_CHECK_INTERVAL or \
+                standings is None or standings.stage != self._stage:
+            standings = self.get()
+
+        return standings.etag
+
+    def invalidate(self):
+        '''
+        Mark the standings as out of date so they are rebuilt on the next read.
+        '''
+        with self._lock:
+            self.version += 1
+            self._standings = None
+            self._changed.notify_all()
+
+            for listener in self._listeners:
+                listener()
+
+    def add_listener(self, listener):
+        '''
+        Register a function to call whenever the leaderboard is invalidated, e.g. to clear caches
+        derived from it.
+
+        :param listener: A function taking no arguments.
+        '''
+        self._listeners.append(listener)
+
+    def wait(self, version: int, timeout: float) -> bool:
+        '''
+        Block until the leaderboard has been invalidated in this process or the timeout expires.
+
+        Changes made by other processes or to the stage are only noticed by `get`, so callers should
+        call `get` after waiting regardless of the result.
+
+        :param version: The version the caller last saw.
+        :param timeout: The maximum number of seconds to wait.
+
+        :return: True if the version has changed, otherwise False.
+        '''
+        with self._changed:
+            if self.version == version:
+                self._changed.wait(timeout)
+
+            return self.version != version
+
+    def _check(self) -> int:
+        '''
+        Invalidate the leaderboard if the stage or database have changed since it was last checked.
+
+        :return: The current stage.
+        '''
+        self._checked = time.monotonic()
+        stage = app.load_stage()
+        signature = _database_signature()
+
+        if self._stage == stage and signature == self._signature:
+            return stage
+
+        with self._lock:
+            if self._stage == stage and signature == self._signature:
+                return stage
+
+            # nothing has been built from the database before the first check
+            if self._stage is not None:
+                self.invalidate()
+
+            self._signature = signature
+            self._stage = stage
+
+            return stage
+
+
+def _content_tag(stage: int, teams: list) -> str:
+    '''
+    Hash the stage and the ranked teams' columns into an entity tag.
+    '''
+    digest = hashlib.sha1(repr(stage).encode('utf-8'))
+
+    for team in teams:
+        digest.update(repr(tuple(getattr(team, c) for c in COLUMNS)).encode('utf-8'))
+
+    return digest.hexdigest()[:16]
+
+
+def _build_entries(rows, stage: int) -> list:
+    '''
+    Build an entry per team from rows selected by `ranking.ranked_select`, keeping their order.
+    '''
+    size = len(TEAM_COLUMNS) + 1
+    return [Entry(r[1:size], dict(zip(SLOTS, r[size:])), stage) for r in rows]
+
+
+def _database_signature():
+    '''
+    Get a value that changes whenever the SQLite database is written to by any other connection, in
+    this process or another.
+
+    Uses SQLite's `data_version`, read from a connection kept open for the purpose as it is only
+    comparable between reads on the same connection. The connection is reopened in processes forked
+    from this one, e.g. by `flask serve`.
+    '''
+    path = db.engine.url.database
+
+    # don't create the database just to watch it
+    if not path or path == ':memory:' or not os.path.exists(path):
+        return None
+
+    key = (os.getpid(), path)
+
+    with _watcher_lock:
+        con = _watchers.get(key)
+
+        # the parent's connections are left alone as they're still in use by the parent
+        if con is None:
+            con = _watchers[key] = sqlite3.connect(path, isolation_level=None,
+                                                   check_same_thread=False)
+
+        return con.execute('PRAGMA data_version').fetchone()[0]
+
+
+# the connections used to read the data version, keyed by process and database
+_watchers = {}
+_watcher_lock = threading.Lock()
+
+# a leaderboard per event, keyed by name, and None when serving a single event
+_leaderboards = {}
+_leaderboards_lock = threading.Lock()
+# shared by every leaderboard, so listeners are told about changes to any event
+_listeners = []
+
+
+def _current_leaderboard() -> Leaderboard:
+    name = current_name()
+    board = _leaderboards.get(name)
+
+    if board is None:
+        with _leaderboards_lock:
+            board = _leaderboards.setdefault(name, Leaderboard(_listeners))
+
+    return board
+
+
+# the leaderboard of the event being handled
+leaderboard = LocalProxy(_current_leaderboard)
+
+_DIRTY_KEY = 'lego_leaderboard_dirty'
+
+
+@event.listens_for(db.session, 'after_flush')
+def _after_flush(session, flush_context):
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (Team, Score)):
+            session.info[_DIRTY_KEY] = True
+            return
+
+
+@event.listens_for(db.session, 'after_bulk_update')
+@event.listens_for(db.session, 'after_bulk_delete')
+def _after_bulk(context):
+    context.session.info[_DIRTY_KEY] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _after_commit(session):
+    if session.info.pop(_DIRTY_KEY, False):
+        leaderboard.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop(_DIRTY_KEY, None)
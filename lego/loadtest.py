@@ -0,0 +1,389 @@
+# -----------------------------------------------------------------------------
+# A load generator for checking the application copes with an event day.
+#
+# Starts the application in a separate process against a temporary database
+# and stage file, then simulates scoreboard displays, top ten screens and
+# judges submitting scores from a pool of threads. Each simulated client has
+# its own session, so judges log in and submit the score form, including the
+# CSRF token and the confirmation step, exactly as a browser would.
+# -----------------------------------------------------------------------------
+
+from collections import OrderedDict
+from http.cookiejar import CookieJar
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, build_opener
+
+from sqlalchemy import create_engine
+
+from lego import db
+from lego.forms.score_round_form import MISSIONS_PATH
+from lego.models import Team, User
+from lego.util import StageStore
+
+
+__all__ = ['Stats', 'Client', 'random_sheet', 'run']
+
+# the prefix of the temporary team names, used to check the server is using the temporary database
+TEAM_PREFIX = 'Load Test Team'
+
+JUDGE_USERNAME = 'Judge'
+JUDGE_PASSWORD = 'judge'
+
+_CSRF_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+# the practice team is skipped as its scores are never confirmed
+_TEAM_RE = re.compile(r'<option[^>]*value="(\d+)"[^>]*>\s*{!s}'.format(TEAM_PREFIX))
+
+
+class Stats(object):
+    '''
+    Thread safe collection of the response times for each route.
+    '''
+
+    def __init__(self):
+        self._times = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, route: str, seconds: float, ok: bool=True):
+        '''
+        Record a single request.
+
+        :param route: The route requested, e.g. `GET /top_ten`.
+        :param seconds: How long the request took.
+        :param ok: Whether the expected response was received.
+        '''
+        with self._lock:
+            self._times.setdefault(route, []).append(seconds)
+            self._errors.setdefault(route, 0)
+
+            if not ok:
+                self._errors[route] += 1
+
+    def report(self, duration: float) -> list:
+        '''
+        Summarise the requests for each route.
+
+        :param duration: How long the requests were made for, in seconds.
+
+        :return: A list of dicts, one per route in name order, holding the route, the number of
+            requests, the number of errors, the requests per second and the 50th, 95th and 99th
+            percentile response times in milliseconds.
+        '''
+        rows = []
+
+        with self._lock:
+            for route in sorted(self._times):
+                times = sorted(self._times[route])
+                rows.append(OrderedDict([
+                    ('route', route),
+                    ('requests', len(times)),
+                    ('errors', self._errors[route]),
+                    ('per_second', len(times) / duration),
+                    ('p50', _percentile(times, 50) * 1000),
+                    ('p95', _percentile(times, 95) * 1000),
+                    ('p99', _percentile(times, 99) * 1000),
+                ]))
+
+        return rows
+
+
+def _percentile(values: list, percent: int) -> float:
+    '''
+    Get a percentile of sorted values using the nearest rank.
+    '''
+    if not values:
+        return 0.0
+
+    rank = max(math.ceil(percent / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+
+class _NoRedirect(HTTPRedirectHandler):
+    '''
+    Return redirects as responses so they can be checked and timed separately.
+    '''
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Client(object):
+    '''
+    A single simulated browser with its own cookies.
+    '''
+
+    def __init__(self, base_url: str, stats: Stats):
+        '''
+        :param base_url: The URL of the application, e.g. `http://127.0.0.1:5000`.
+        :param stats: Where to record the requests made.
+        '''
+        self.base_url = base_url
+        self.stats = stats
+        self._opener = build_opener(HTTPCookieProcessor(CookieJar()), _NoRedirect())
+
+    def request(self, route: str, path: str, data: dict=None, expect: int=200) -> (int, str):
+        '''
+        Make a request and record how long it took.
+
+        :param route: The name to record the request under.
+        :param path: The path to request.
+        :param data: Form data to POST. The request is a GET if this is None.
+        :param expect: The status code expected.
+
+        :return: A tuple of the status code and the body. The status is 0 if the request failed.
+        '''
+        body = None if data is None else urlencode(data).encode('utf-8')
+        start = time.time()
+
+        try:
+            with self._opener.open(self.base_url + path, body, timeout=30) as resp:
+                status, text = resp.status, resp.read().decode('utf-8')
+        except HTTPError as exc:
+            status, text = exc.code, ''
+        except (URLError, OSError):
+            status, text = 0, ''
+
+        self.stats.record(route, time.time() - start, status == expect)
+
+        return status, text
+
+
+def _csrf_token(html: str) -> str:
+    match = _CSRF_RE.search(html)
+    return match.group(1) if match else ''
+
+
+def random_sheet(missions: dict, rng: random.Random=random) -> dict:
+    '''
+    Fill in the score form's missions at random.
+
+    :param missions: The missions as loaded from missions.json.
+    :param rng: The random number generator to use, e.g. a seeded `random.Random`.
+
+    :return: The submitted values keyed by field name, as the score form would post them.
+    '''
+    sheet = {}
+
+    for name, tasks in missions.items():
+        for task_no, task in enumerate(tasks):
+            field = 'missions-{!s}-{:d}'.format(name, task_no)
+
+            if task['type'] in ('BooleanField', 'CheckboxField'):
+                if rng.random() < 0.7:
+                    sheet[field] = task.get('value', 'y')
+            elif task['type'] in ('RadioField', 'SelectField'):
+                sheet[field] = rng.choice(task['choices'])['value']
+
+    return sheet
+
+
+def _scoreboard(client: Client, stop: threading.Event, interval: float, teams: int):
+    '''
+    A scoreboard display, moving to the next page of teams each interval.
+    '''
+    offset = 0
+
+    while not stop.is_set():
+        client.request('GET /scoreboard/<offset>',
+                       '/scoreboard/{:d}'.format(offset) if offset else '/scoreboard/')
+        offset = offset + 10 if offset + 10 < teams else 0
+        stop.wait(interval)
+
+
+def _top_ten(client: Client, stop: threading.Event, interval: float):
+    '''
+    A top ten screen, refreshing each interval.
+    '''
+    while not stop.is_set():
+        client.request('GET /top_ten', '/top_ten')
+        stop.wait(interval)
+
+
+def _judge(client: Client, stop: threading.Event, interval: float, missions: dict):
+    '''
+    A judge scoring a random team each interval, including the confirmation step.
+    '''
+    _, html = client.request('GET /login', '/login')
+    client.request('POST /login', '/login', {'csrf_token': _csrf_token(html),
+                                              'username': JUDGE_USERNAME,
+                                              'password': JUDGE_PASSWORD}, expect=302)
+
+    while not stop.is_set():
+        status, html = client.request('GET /judges/score_round', '/judges/score_round')
+        teams = _TEAM_RE.findall(html)
+
+        if status == 200 and teams:
+            data = random_sheet(missions)
+            data.update({'csrf_token': _csrf_token(html), 'team': random.choice(teams)})
+            status, html = client.request('POST /judges/score_round', '/judges/score_round', data)
+
+            if status == 200:
+                data.update({'csrf_token': _csrf_token(html), 'confirm': '1'})
+                client.request('POST /judges/score_round (confirm)', '/judges/score_round',
+                               data, expect=302)
+
+        stop.wait(interval)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _create_database(path: str, teams: int):
+    '''
+    Create a database holding the default users, the practice team and the given number of teams.
+    '''
+    engine = create_engine('sqlite:///' + path)
+    db.metadata.create_all(engine)
+
+    with engine.begin() as con:
+        con.execute(User.__table__.insert(), [
+            {'username': 'Admin', 'password': 'admin', 'is_admin': True, 'is_judge': False},
+            {'username': JUDGE_USERNAME, 'password': JUDGE_PASSWORD, 'is_admin': False,
+             'is_judge': True},
+        ])
+        con.execute(Team.__table__.insert(), [
+            {'number': -1, 'name': 'Practice', 'active': True, 'is_practice': True},
+        ] + [
+            {'number': i, 'name': '{!s} {:d}'.format(TEAM_PREFIX, i), 'active': True,
+             'is_practice': False} for i in range(1, teams + 1)
+        ])
+
+    engine.dispose()
+
+
+def _start_server(tmp_dir: str, port: int, workers: int=0) -> subprocess.Popen:
+    '''
+    Start the application in a new process using the temporary database and stage file, with
+    `flask run`, or `flask serve` if a number of workers is given.
+    '''
+    env = dict(os.environ)
+    env.update({
+        'LEGO_DATABASE': os.path.join(tmp_dir, 'app.db'),
+        'LEGO_STAGE': os.path.join(tmp_dir, '.stage'),
+    })
+    env.pop('FLASK_DEBUG', None)
+
+    if workers:
+        cmd = [sys.executable, '-m', 'flask', 'serve', '--host', '127.0.0.1', '--port', str(port),
+               '--workers', str(workers)]
+    else:
+        cmd = [sys.executable, '-m', 'flask', 'run', '--host', '127.0.0.1', '--port', str(port),
+               '--with-threads', '--no-reload', '--no-debugger']
+
+    return subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _wait_for_server(base_url: str, timeout: float=30):
+    '''
+    Wait for the server to start and check it is using the temporary database.
+    '''
+    client = Client(base_url, Stats())
+    stop = time.time() + timeout
+
+    while time.time() < stop:
+        status, html = client.request('GET /top_ten', '/top_ten')
+
+        if status == 200:
+            if TEAM_PREFIX not in html:
+                raise RuntimeError('The server is not using the temporary database. Make sure '
+                                   'SQLALCHEMY_DATABASE_URI in config.py is set using db_uri() '
+                                   'and STAGE_PATH using stage_path() as in config.sample.py.')
+            return
+
+        time.sleep(0.2)
+
+    raise RuntimeError('The server did not start within {:d} seconds.'.format(int(timeout)))
+
+
+def run(tmp_dir: str, duration: float, interval: float, scoreboards: int, top_tens: int,
+        judges: int, teams: int, workers: int=0) -> dict:
+    '''
+    Run a load test against a new instance of the application.
+
+    :param tmp_dir: An empty directory to hold the temporary database and stage file.
+    :param duration: How long to generate load for, in seconds.
+    :param interval: How long each simulated client waits between requests, in seconds.
+    :param scoreboards: The number of scoreboard displays to simulate.
+    :param top_tens: The number of top ten screens to simulate.
+    :param judges: The number of judges to simulate.
+    :param teams: The number of teams in the temporary database.
+    :param workers: The number of worker processes to run the application with using `flask serve`,
+        or 0 to use `flask run`.
+
+    :return: A dict holding the settings used and the report from `Stats.report`.
+    '''
+    _create_database(os.path.join(tmp_dir, 'app.db'), teams)
+    StageStore(os.path.join(tmp_dir, '.stage')).save(0)
+
+    with open(MISSIONS_PATH) as fh:
+        missions = json.load(fh)
+
+    port = _free_port()
+    base_url = 'http://127.0.0.1:{:d}'.format(port)
+    server = _start_server(tmp_dir, port, workers)
+
+    try:
+        _wait_for_server(base_url)
+
+        stats = Stats()
+        stop = threading.Event()
+        threads = []
+
+        for _ in range(scoreboards):
+            threads.append((_scoreboard, (interval, teams)))
+
+        for _ in range(top_tens):
+            threads.append((_top_ten, (interval,)))
+
+        for _ in range(judges):
+            threads.append((_judge, (interval, missions)))
+
+        def start(target, args):
+            # spread the clients out over the first interval, as real screens are
+            stop.wait(random.uniform(0, interval))
+            target(Client(base_url, stats), stop, *args)
+
+        threads = [threading.Thread(target=start, args=t, daemon=True) for t in threads]
+
+        started = time.time()
+
+        for thread in threads:
+            thread.start()
+
+        time.sleep(duration)
+        stop.set()
+
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.time() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    return OrderedDict([
+        ('settings', OrderedDict([
+            ('duration', duration),
+            ('interval', interval),
+            ('scoreboards', scoreboards),
+            ('top_tens', top_tens),
+            ('judges', judges),
+            ('teams', teams),
+            ('workers', workers),
+        ])),
+        ('routes', stats.report(elapsed)),
+    ])
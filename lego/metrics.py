@@ -0,0 +1,345 @@
+# -----------------------------------------------------------------------------
+# Request, SQL and template instrumentation.
+#
+# Records the time taken by each request, the number and time of the SQL
+# statements it ran, the number of times it loaded the stage and the time
+# taken to render each template. Times are kept in fixed-bucket histograms so
+# the memory used doesn't grow over the day, and are exposed in the Prometheus
+# text format at /admin/metrics.
+#
+# Counts for the request being handled are kept per thread, so SQL run outside
+# of a request, e.g. by the CLI, is only included in the totals.
+# -----------------------------------------------------------------------------
+
+import threading
+import time
+
+from flask import request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from lego import app
+
+
+__all__ = ['Counter', 'Histogram', 'Registry', 'registry', 'CONTENT_TYPE']
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# bucket upper bounds, the +Inf bucket is always added
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+# the endpoint recorded for requests which didn't match a route
+UNMATCHED = '<unmatched>'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple, extra: str='') -> str:
+    '''
+    Format the labels of a sample, e.g. `{endpoint="top_ten"}`.
+    '''
+    pairs = ['{!s}="{!s}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    '''
+    A thread safe count for each combination of label values.
+    '''
+
+    type_ = 'counter'
+
+    def __init__(self, name: str, help_: str, label_names: tuple=()):
+        '''
+        :param name: The metric name.
+        :param help_: A description of the metric.
+        :param label_names: The names of the labels, e.g. `('endpoint',)`.
+        '''
+        self.name = name
+        self.help = help_
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple=(), amount=1):
+        '''
+        Add to the count.
+
+        :param labels: The label values, in the same order as the label names.
+        :param amount: The amount to add.
+        '''
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels: tuple=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self) -> list:
+        '''
+        Get the samples in the text format, one per line.
+        '''
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return ['{!s}{!s} {!s}'.format(self.name, _labels(self.label_names, k), _number(v))
+                for k, v in values]
+
+
+class Histogram(object):
+    '''
+    A thread safe histogram with fixed buckets for each combination of label values.
+    '''
+
+    type_ = 'histogram'
+
+    def __init__(self, name: str, help_: str, label_names: tuple=(),
+                 buckets: tuple=SECONDS_BUCKETS):
+        '''
+        :param name: The metric name.
+        :param help_: A description of the metric.
+        :param label_names: The names of the labels, e.g. `('endpoint',)`.
+        :param buckets: The upper bound of each bucket in ascending order.
+        '''
+        self.name = name
+        self.help = help_
+        self.label_names = label_names
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # label values to ([count per bucket], sum)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value):
+        '''
+        Record a value.
+
+        :param labels: The label values, in the same order as the label names.
+        :param value: The value, e.g. a time in seconds.
+        '''
+        with self._lock:
+            counts, total = self._values.get(labels) or ([0] * len(self.buckets), 0)
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+
+            self._values[labels] = (counts, total + value)
+
+    def samples(self) -> list:
+        '''
+        Get the samples in the text format, one per line. Bucket counts are cumulative.
+        '''
+        with self._lock:
+            values = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+
+        lines = []
+
+        for labels, (counts, total) in values:
+            cumulative = 0
+
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="{!s}"'.format(_number(bound))
+                lines.append('{!s}_bucket{!s} {:d}'
+                             .format(self.name, _labels(self.label_names, labels, le), cumulative))
+
+            label_str = _labels(self.label_names, labels)
+            lines.append('{!s}_sum{!s} {!s}'.format(self.name, label_str, _number(total)))
+            lines.append('{!s}_count{!s} {:d}'.format(self.name, label_str, cumulative))
+
+        return lines
+
+
+class Registry(object):
+    '''
+    The metrics recorded by the application.
+    '''
+
+    def __init__(self):
+        self.requests = Counter(
+            'lego_requests_total', 'Requests handled.', ('endpoint', 'status'))
+        self.request_seconds = Histogram(
+            'lego_request_seconds', 'Time taken to handle a request.', ('endpoint',))
+        self.request_queries = Histogram(
+            'lego_request_queries', 'SQL statements run by a request.', ('endpoint',),
+            COUNT_BUCKETS)
+        self.request_query_seconds = Histogram(
+            'lego_request_query_seconds', 'Time spent running SQL statements in a request.',
+            ('endpoint',))
+        self.load_stage = Counter(
+            'lego_load_stage_total', 'Calls to load the stage, by the endpoint making them.',
+            ('endpoint',))
+        self.queries = Counter(
+            'lego_sql_queries_total', 'SQL statements run, including outside of requests.')
+        self.query_seconds = Counter(
+            'lego_sql_seconds_total', 'Time spent running SQL statements, including outside of '
+            'requests.')
+        self.template_seconds = Histogram(
+            'lego_template_render_seconds', 'Time taken to render a template.', ('template',))
+
+    @property
+    def metrics(self) -> list:
+        return [self.requests, self.request_seconds, self.request_queries,
+                self.request_query_seconds, self.load_stage, self.queries, self.query_seconds,
+                self.template_seconds]
+
+    def render(self) -> str:
+        '''
+        Render every metric in the Prometheus text exposition format.
+        '''
+        lines = []
+
+        for metric in self.metrics:
+            lines.append('# HELP {!s} {!s}'.format(metric.name, metric.help))
+            lines.append('# TYPE {!s} {!s}'.format(metric.name, metric.type_))
+            lines.extend(metric.samples())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class _Tally(object):
+    '''
+    The counts for the request being handled by a thread.
+    '''
+    __slots__ = ('start', 'queries', 'query_seconds', 'load_stage', 'recorded')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.load_stage = 0
+        self.recorded = False
+
+
+_local = threading.local()
+
+
+def _endpoint() -> str:
+    return request.endpoint or UNMATCHED
+
+
+def _record(status):
+    '''
+    Record the request being handled, once.
+    '''
+    tally = getattr(_local, 'tally', None)
+
+    if tally is None or tally.recorded:
+        return
+
+    tally.recorded = True
+    _local.tally = None
+    endpoint = _endpoint()
+
+    registry.requests.inc((endpoint, str(status)))
+    registry.request_seconds.observe((endpoint,), time.perf_counter() - tally.start)
+    registry.request_queries.observe((endpoint,), tally.queries)
+    registry.request_query_seconds.observe((endpoint,), tally.query_seconds)
+
+    if tally.load_stage:
+        registry.load_stage.inc((endpoint,), tally.load_stage)
+
+
+def _before_request():
+    _local.tally = _Tally()
+
+
+def _after_request(response):
+    _record(response.status_code)
+    return response
+
+
+def _teardown_request(exc):
+    # after_request isn't called for unhandled errors
+    if exc is not None:
+        _record(500)
+
+    _local.tally = None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('lego_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['lego_query_start'].pop()
+    registry.queries.inc()
+    registry.query_seconds.inc(amount=seconds)
+
+    tally = getattr(_local, 'tally', None)
+
+    if tally is not None:
+        tally.queries += 1
+        tally.query_seconds += seconds
+
+
+def _counted(load_stage):
+    '''
+    Wrap `app.load_stage` to count the calls made by each request.
+    '''
+    def wrapper() -> int:
+        tally = getattr(_local, 'tally', None)
+
+        if tally is not None:
+            tally.load_stage += 1
+
+        return load_stage()
+
+    wrapper.__doc__ = load_stage.__doc__
+
+    return wrapper
+
+
+class TimedTemplate(Template):
+    '''
+    Template which records the time taken to render it. Used instead of Flask's template rendered
+    signal as that requires blinker.
+    '''
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            registry.template_seconds.observe((self.name,), time.perf_counter() - start)
+
+
+def init_app(app):
+    '''
+    Install the instrumentation. Templates loaded before this is called aren't timed.
+
+    :param app: The application.
+    '''
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    app.load_stage = _counted(app.load_stage)
+    app.jinja_env.template_class = TimedTemplate
+
+
+if app.config.get('METRICS_ENABLED', True):
+    init_app(app)
@@ -0,0 +1,144 @@
+# -----------------------------------------------------------------------------
+# Upgrades for databases created by older versions of the application.
+#
+# Each upgrade checks whether it is needed, so upgrading an up to date database
+# does nothing. All upgrades are run in a single transaction.
+# -----------------------------------------------------------------------------
+
+import sqlite3
+
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from lego import db
+from lego.breakdowns import LEGACY_PREFIX
+from lego.forms.score_round_form import codec
+from lego.models import MissionStat, Score, StageStat, Team
+from lego.models.mission_stat import tally
+from lego.models.score import SLOTS
+
+
+__all__ = ['upgrade']
+
+
+def upgrade(path: str) -> list:
+    '''
+    Upgrade a SQLite database to the current schema.
+
+    :param path: The path to the database file.
+
+    :return: A list of descriptions of the upgrades that were applied.
+    '''
+    con = sqlite3.connect(path, isolation_level=None)
+    applied = []
+
+    try:
+        # foreign keys must be off while tables are recreated
+        con.execute('PRAGMA foreign_keys = OFF')
+        con.execute('BEGIN')
+
+        for description, needed, apply in UPGRADES:
+            if needed(con):
+                apply(con)
+                applied.append(description)
+
+        con.execute('COMMIT')
+    except Exception:
+        con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+
+    return applied
+
+
+def _columns(con, table: str) -> list:
+    '''
+    Get the names of the columns in a table.
+    '''
+    return [r[1] for r in con.execute('PRAGMA table_info({!s})'.format(table))]
+
+
+def _create(con, table):
+    '''
+    Create a table and its indexes from its model.
+    '''
+    dialect = db.engine.dialect
+    con.execute(str(CreateTable(table).compile(dialect=dialect)))
+
+    for index in table.indexes:
+        con.execute(str(CreateIndex(index).compile(dialect=dialect)))
+
+
+def _needs_score_table(con) -> bool:
+    return 'attempt_1' in _columns(con, 'team')
+
+
+def _create_score_table(con):
+    '''
+    Move the scores from the columns of the team table to rows in the score table.
+    '''
+    # the index names would clash with those of the new team table
+    for name, in con.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND "
+                             "tbl_name = 'team' AND sql IS NOT NULL").fetchall():
+        con.execute('DROP INDEX {!s}'.format(name))
+
+    con.execute('ALTER TABLE team RENAME TO team_legacy')
+    _create(con, Team.__table__)
+    _create(con, Score.__table__)
+
+    con.execute('INSERT INTO team (id, number, name, active, is_practice) '
+                'SELECT id, number, name, active, is_practice FROM team_legacy')
+
+    for key, (stage, attempt) in SLOTS.items():
+        con.execute('INSERT INTO score (team_id, stage, attempt, total, breakdown) '
+                    'SELECT id, ?, ?, {0!s}, {0!s}_breakdown FROM team_legacy '
+                    'WHERE {0!s} IS NOT NULL'.format(key), (stage, attempt))
+
+    con.execute('DROP TABLE team_legacy')
+
+
+def _needs_breakdown_encoding(con) -> bool:
+    if not _columns(con, 'score'):
+        return False
+
+    return con.execute("SELECT 1 FROM score WHERE breakdown LIKE ? || '%' LIMIT 1",
+                       (LEGACY_PREFIX,)).fetchone() is not None
+
+
+def _encode_breakdowns(con):
+    '''
+    Convert the breakdowns stored as the repr of an OrderedDict to the compact format, see
+    lego.breakdowns.
+    '''
+    rows = con.execute("SELECT id, breakdown FROM score WHERE breakdown LIKE ? || '%'",
+                       (LEGACY_PREFIX,)).fetchall()
+
+    con.executemany('UPDATE score SET breakdown = ? WHERE id = ?',
+                    [(codec.encode(codec.decode(breakdown)), id_) for id_, breakdown in rows])
+
+
+def _needs_mission_stats(con) -> bool:
+    return bool(_columns(con, 'score')) and not _columns(con, 'mission_stat')
+
+
+def _create_mission_stats(con):
+    '''
+    Create the mission statistics tables and count the existing scores.
+    '''
+    _create(con, StageStat.__table__)
+    _create(con, MissionStat.__table__)
+
+    scores, missions = tally(con.execute('SELECT stage, breakdown FROM score'))
+
+    con.executemany('INSERT INTO stage_stat (stage, scores) VALUES (?, ?)', scores.items())
+    con.executemany('INSERT INTO mission_stat (stage, mission, scored, points) VALUES (?, ?, ?, ?)',
+                    [(s, m, n, p) for (s, m), (n, p) in missions.items()])
+
+
+# the upgrades in the order they are applied, as (description, needed, apply)
+UPGRADES = (
+    ('Moved scores to the score table.', _needs_score_table, _create_score_table),
+    ('Converted score breakdowns to the compact format.', _needs_breakdown_encoding,
+     _encode_breakdowns),
+    ('Counted the mission statistics.', _needs_mission_stats, _create_mission_stats),
+)
@@ -3,4 +3,6 @@
 # -----------------------------------------------------------------------------
 
 from lego.models.user import User
+from lego.models.score import Score
+from lego.models.mission_stat import MissionStat, StageStat
 from lego.models.team import Team
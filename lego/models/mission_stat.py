@@ -0,0 +1,170 @@
+# -----------------------------------------------------------------------------
+# The models for the per-mission statistics.
+#
+# For each stage, the number of scores with a breakdown is held along with, for
+# each mission, the number of those scores in which it scored and its total
+# points. They are updated in the same transaction as the scores are saved or
+# reset, so reading them takes a row per stage and mission however many teams
+# there are.
+# -----------------------------------------------------------------------------
+
+from collections import Counter
+
+from sqlalchemy import bindparam
+
+from lego import db
+from lego.breakdowns import mission_id, stored_points
+from lego.models.score import Score
+
+
+__all__ = ['MissionStat', 'StageStat', 'record_scores', 'rebuild', 'summary', 'tally']
+
+
+class StageStat(db.Model):
+    __tablename__ = 'stage_stat'
+
+    stage = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # the number of scores with a breakdown
+    scores = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return '<StageStat stage={!r}, scores={!r}>'.format(self.stage, self.scores)
+
+
+class MissionStat(db.Model):
+    __tablename__ = 'mission_stat'
+
+    stage = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # the mission ID, see lego.breakdowns
+    mission = db.Column(db.String(40), primary_key=True)
+    # the number of scores in which the mission scored any points
+    scored = db.Column(db.Integer, default=0, nullable=False)
+    # the total points scored for the mission
+    points = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return '<MissionStat stage={!r}, mission={!r}, scored={!r}, points={!r}>' \
+            .format(self.stage, self.mission, self.scored, self.points)
+
+
+def tally(rows) -> (Counter, dict):
+    '''
+    Count the breakdowns of a number of scores. Scores without a breakdown, e.g. those entered by
+    an admin, aren't counted.
+
+    :param rows: (stage, stored breakdown) tuples.
+
+    :return: A Counter of the scores per stage, and a dict mapping (stage, mission ID) to a list of
+        the number of scores in which the mission scored and its total points.
+    '''
+    scores = Counter()
+    missions = {}
+
+    for stage, breakdown in rows:
+        points = stored_points(breakdown)
+
+        if points is None:
+            continue
+
+        scores[stage] += 1
+
+        for mission, value in points.items():
+            if value:
+                stat = missions.setdefault((stage, mission), [0, 0])
+                stat[0] += 1
+                stat[1] += value
+
+    return scores, missions
+
+
+def record_scores(stage: int, breakdowns: list, sign: int=1):
+    '''
+    Add the breakdowns of scores saved in a stage to the statistics, or remove those of scores being
+    reset. Runs in the session's transaction, so the statistics are committed or rolled back along
+    with the scores. The caller commits.
+
+    :param stage: The stage the scores were made in.
+    :param breakdowns: The stored breakdowns of the scores. Empty breakdowns are skipped.
+    :param sign: 1 to add the scores, -1 to remove them.
+    '''
+    scores, missions = tally((stage, b) for b in breakdowns)
+
+    if not scores:
+        return
+
+    stages = StageStat.__table__
+    stats = MissionStat.__table__
+
+    db.session.execute(stages.insert().prefix_with('OR IGNORE'), [{'stage': stage, 'scores': 0}])
+    db.session.execute(stages.update().where(stages.c.stage == stage)
+                       .values(scores=stages.c.scores + sign * scores[stage]))
+
+    if missions:
+        db.session.execute(stats.insert().prefix_with('OR IGNORE'),
+                           [{'stage': stage, 'mission': m, 'scored': 0, 'points': 0}
+                            for _, m in missions])
+        db.session.execute(stats.update()
+                           .where((stats.c.stage == stage) & (stats.c.mission == bindparam('m')))
+                           .values(scored=stats.c.scored + bindparam('d_scored'),
+                                   points=stats.c.points + bindparam('d_points')),
+                           [{'m': m, 'd_scored': sign * n, 'd_points': sign * p}
+                            for (_, m), (n, p) in missions.items()])
+
+
+def rebuild():
+    '''
+    Recount the statistics from every score, e.g. after teams have been deleted. The caller
+    commits.
+    '''
+    scores, missions = tally(db.session.query(Score.stage, Score.breakdown))
+
+    db.session.execute(MissionStat.__table__.delete())
+    db.session.execute(StageStat.__table__.delete())
+
+    if scores:
+        db.session.execute(StageStat.__table__.insert(),
+                           [{'stage': s, 'scores': n} for s, n in scores.items()])
+
+    if missions:
+        db.session.execute(MissionStat.__table__.insert(),
+                           [{'stage': s, 'mission': m, 'scored': n, 'points': p}
+                            for (s, m), (n, p) in missions.items()])
+
+
+def summary(stages: list, missions: list) -> list:
+    '''
+    Build the statistics for display.
+
+    :param stages: The stages to include, e.g. `Format.stages`.
+    :param missions: The mission names, in order.
+
+    :return: A dict per stage holding its `number`, `name`, the number of `scores` and a dict per
+        mission holding its `name`, `id`, the number of scores in which it `scored`, its
+        `success_rate` as a fraction of the scores and its `mean_points`. The rate and mean are
+        None if the stage has no scores.
+    '''
+    scores = {s.stage: s.scores for s in StageStat.query}
+    stats = {(s.stage, s.mission): s for s in MissionStat.query}
+    result = []
+
+    for stage in stages:
+        count = scores.get(stage.number, 0)
+        rows = []
+
+        for name in missions:
+            i = mission_id(name)
+            stat = stats.get((stage.number, i))
+            scored, points = (stat.scored, stat.points) if stat else (0, 0)
+
+            rows.append({
+                'name': name,
+                'id': i,
+                'scored': scored,
+                'success_rate': scored / count if count else None,
+                'mean_points': points / count if count else None,
+            })
+
+        result.append({'number': stage.number, 'name': stage.name, 'scores': count,
+                       'missions': rows})
+
+    return result
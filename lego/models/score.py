@@ -0,0 +1,49 @@
+# -----------------------------------------------------------------------------
+# The model for a single score in the database.
+# -----------------------------------------------------------------------------
+
+from collections import OrderedDict
+
+from sqlalchemy.orm import deferred
+
+from lego import db
+
+
+__all__ = ['Score', 'SLOTS', 'STAGE_ATTEMPTS']
+
+# the named score slots used by the forms and templates, mapped to their (stage, attempt)
+SLOTS = OrderedDict([
+    ('attempt_1', (0, 1)),
+    ('attempt_2', (0, 2)),
+    ('attempt_3', (0, 3)),
+    ('round_2', (1, 1)),
+    ('quarter', (2, 1)),
+    ('semi', (3, 1)),
+    ('final', (4, 1)),
+])
+
+# the most attempts a stage can have, one per score slot. Competition formats can use fewer, see
+# lego.formats
+STAGE_ATTEMPTS = (3, 1, 1, 1, 1)
+
+
+class Score(db.Model):
+    __tablename__ = 'score'
+    __table_args__ = (
+        db.UniqueConstraint('team_id', 'stage', 'attempt'),
+        db.Index('ix_score_stage_total', 'stage', 'total'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = db.Column(db.Integer, db.ForeignKey('team.id', ondelete='CASCADE'), nullable=False)
+    stage = db.Column(db.Integer, nullable=False)
+    attempt = db.Column(db.Integer, default=1, nullable=False)
+    total = db.Column(db.Integer, nullable=False)
+    # the points for each mission, see lego.breakdowns. Only needed for exports so don't load it
+    # with the totals
+    breakdown = deferred(db.Column(db.String, nullable=True))
+
+    def __repr__(self):
+        name = self.__class__.__name__
+        return '<{!s}(team_id={!r}, stage={!r}, attempt={!r}, total={!r}>' \
+            .format(name, self.team_id, self.stage, self.attempt, self.total)
@@ -4,12 +4,31 @@
 
 from sqlalchemy.ext.hybrid import hybrid_property
 
-from lego import app, db
+from lego import app, db, ranking
+from lego.models.mission_stat import record_scores
+from lego.models.score import Score, SLOTS, STAGE_ATTEMPTS
+from lego import formats
 
 
 __all__ = ['Team']
 
 
+def _slot_property(key: str) -> property:
+    '''
+    Create a read-only property for the total of the score in a slot. See `SLOTS`.
+    '''
+    stage, attempt = SLOTS[key]
+
+    def getter(self):
+        for score in self.scores:
+            if score.stage == stage and score.attempt == attempt:
+                return score.total
+
+        return None
+
+    return property(getter)
+
+
 class Team(db.Model):
     __tablename__ = 'team'
 
@@ -18,21 +37,17 @@ class Team(db.Model):
     name = db.Column(db.String(80), index=True, unique=True, nullable=False)
     active = db.Column(db.Boolean, default=True, nullable=False)
     is_practice = db.Column(db.Boolean, default=False, nullable=False)
-    attempt_1 = db.Column(db.Integer, nullable=True)
-    attempt_1_breakdown = db.Column(db.String, nullable=True)
-    attempt_2 = db.Column(db.Integer, nullable=True)
-    attempt_2_breakdown = db.Column(db.String, nullable=True)
-    attempt_3 = db.Column(db.Integer, nullable=True)
-    attempt_3_breakdown = db.Column(db.String, nullable=True)
-    round_2 = db.Column(db.Integer, nullable=True)
-    round_2_breakdown = db.Column(db.String, nullable=True)
-    quarter = db.Column(db.Integer, nullable=True)
-    quarter_breakdown = db.Column(db.String, nullable=True)
-    semi = db.Column(db.Integer, nullable=True)
-    semi_breakdown = db.Column(db.String, nullable=True)
-    final = db.Column(db.Integer, nullable=True)
-    final_breakdown = db.Column(db.String, nullable=True)
-
+    scores = db.relationship(Score, backref='team', cascade='all, delete-orphan',
+                             passive_deletes=True)
+
+    # the score for each slot, read from the scores
+    attempt_1 = _slot_property('attempt_1')
+    attempt_2 = _slot_property('attempt_2')
+    attempt_3 = _slot_property('attempt_3')
+    round_2 = _slot_property('round_2')
+    quarter = _slot_property('quarter')
+    semi = _slot_property('semi')
+    final = _slot_property('final')
 
     def __repr__(self):
         name = self.__class__.__name__
@@ -44,107 +59,11 @@ class Team(db.Model):
 
     def __lt__(self, other):
         stage = app.load_stage()
-
-        if stage == 4:
-            if (self.final or -1) < (other.final or -1):
-                return True
-
-            if (self.final or -1) > (other.final or -1):
-                return False
-            
-        if stage >= 3:
-            if (self.semi or -1) < (other.semi or -1):
-                return True
-
-            if (self.semi or -1) > (other.semi or -1):
-                return False
-
-        if stage >= 2:
-            if (self.quarter or -1) < (other.quarter or -1):
-                return True
-
-            if (self.quarter or -1) > (other.quarter or -1):
-                return False
-
-        if stage >= 1:
-            if (self.round_2 or -1) < (other.round_2 or -1):
-                return True
-
-            if (self.round_2 or -1) > (other.round_2 or -1):
-                return False
-
-        if stage >= 0:
-            s_attempt = [a if a is not None else -1 for a in self.attempts]
-            o_attempt = [a if a is not None else -1 for a in other.attempts]
-
-            s_attempt.sort(reverse=True)
-            o_attempt.sort(reverse=True)
-
-            for s, o in zip(s_attempt, o_attempt):
-                if s < o:
-                    return True
-
-                if s > o:
-                    return False
-
-        # we want to order by score highest to lowest
-        # but if we fall back to this, we order by lowest number to highest
-        if self.number > other.number:
-            return True
-
-        return False
+        return ranking.sort_key(self, stage) < ranking.sort_key(other, stage)
 
     def __gt__(self, other):
         stage = app.load_stage()
-
-        if stage == 4:
-            if (self.final or -1) > (other.final or -1):
-                return True
-
-            if (self.final or -1) < (other.final or -1):
-                return False
-
-        if stage >= 3:
-            if (self.semi or -1) > (other.semi or -1):
-                return True
-
-            if (self.semi or -1) < (other.semi or -1):
-                return False
-
-        if stage >= 2:
-            if (self.quarter or -1) > (other.quarter or -1):
-                return True
-
-            if (self.quarter or -1) < (other.quarter or -1):
-                return False
-
-        if stage >= 1:
-            if (self.round_2 or -1) > (other.round_2 or -1):
-                return True
-
-            if (self.round_2 or -1) < (other.round_2 or -1):
-                return False
-
-        if stage >= 0:
-            s_attempt = [a if a is not None else -1 for a in self.attempts]
-            o_attempt = [a if a is not None else -1 for a in other.attempts]
-
-            s_attempt.sort(reverse=True)
-            o_attempt.sort(reverse=True)
-
-            for s, o in zip(s_attempt, o_attempt):
-                if s > o:
-                    return True
-
-                if s < o:
-                    return False
-
-        # we want to order by score highest to lowest
-        # but if we fall back to this, we order by lowest number to highest
-        if self.number < other.number:
-            return True
-
-        return False
+        return ranking.sort_key(self, stage) > ranking.sort_key(other, stage)
 
     @hybrid_property
     def attempts(self):
@@ -163,84 +82,45 @@ class Team(db.Model):
 
     @hybrid_property
     def highest_score(self):
-        stage = app.load_stage()
-        if stage == 0:
-            return max(self.attempt_1 or 0, self.attempt_2 or 0, self.attempt_3 or 0)
-
-        if stage == 1:
-            return self.round_2 or 0
-
-        if stage == 2:
-            return self.quarter or 0
-
-        if stage == 3:
-            return self.semi or 0
-
-        if stage == 4:
-            return self.final or 0
+        return ranking.highest_score(self, app.load_stage())
 
     def set_score(self, score):
         stage = app.load_stage()
-        app.logger.debug('Stage: %s', stage)
-        app.logger.debug('Team: %s', str(self.__dict__))
         # score is a tuple holding the total score and a breakdown of all previous scores
         score_total, score_breakdown = score
 
-        # first round
-        if stage == 0:
-            if self.attempt_1 is None:
-                self.attempt_1 = score_total
-                self.attempt_1_breakdown = score_breakdown
-            elif self.attempt_2 is None:
-                self.attempt_2 = score_total
-                self.attempt_2_breakdown = score_breakdown
-            elif self.attempt_3 is None:
-                self.attempt_3 = score_total
-                self.attempt_3_breakdown = score_breakdown
-            else:
-                raise Exception('All attempts have been made for this stage.')
-
-        # second round
-        elif stage == 1:
-            if self.round_2 is None:
-                self.round_2 = score_total
-                self.round_2_breakdown = score_breakdown
-            else:
-                raise Exception('All attempts have been made for this stage.')
-
-        # quarter finals
-        elif stage == 2:
-            if self.quarter is None:
-                self.quarter = score_total
-                self.quarter_breakdown = score_breakdown
-            else:
-                raise Exception('All attempts have been made for this stage.')
-
-        # semi finals
-        elif stage == 3:
-            if self.semi is None:
-                self.semi = score_total
-                self.semi_breakdown = score_breakdown
-            else:
-                raise Exception('All attempts have been made for this stage.')
-
-        # finals
-        elif stage == 4:
-            if self.final is None:
-                self.final = score_total
-                self.final_breakdown = score_breakdown
-            else:
-                raise Exception('All attempts have been made for this stage.')
-
-        else:
+        if stage < 0 or stage >= len(STAGE_ATTEMPTS):
             raise Exception('Invalid value for stage.')
 
+        made = {a for a, in db.session.query(Score.attempt).filter_by(team_id=self.id, stage=stage)}
+        allowed = formats.current_format().attempts(stage)
+        attempts = [a for a in range(1, allowed + 1) if a not in made]
+
+        if not attempts:
+            raise Exception('All attempts have been made for this stage.')
+
+        db.session.add(Score(team_id=self.id, stage=stage, attempt=attempts[0], total=score_total,
+                             breakdown=score_breakdown))
+        record_scores(stage, [score_breakdown])
+        app.logger.info('Saving %d for attempt %d of stage %d for team: %s (%d)', score_total,
+                        attempts[0], stage, self.name, self.number)
+
 
     def edit_round_score(self, key, score):
         app.logger.info('Setting %s to %d for team: %s (%d)', key, score, self.name, self.number)
-        setattr(self, key, int(score))
+        stage, attempt = SLOTS[key]
+        row = Score.query.filter_by(team_id=self.id, stage=stage, attempt=attempt).first()
+
+        # only the total changes, not the breakdown, so the mission statistics stay the same
+        if row is None:
+            db.session.add(Score(team_id=self.id, stage=stage, attempt=attempt, total=int(score)))
+        else:
+            row.total = int(score)
 
 
     def reset_round_score(self, key):
         app.logger.info('Resetting %s for team: %s (%d)', key, self.name, self.number)
-        setattr(self, key, None)
+        stage, attempt = SLOTS[key]
+        query = Score.query.filter_by(team_id=self.id, stage=stage, attempt=attempt)
+        record_scores(stage, [b for b, in query.with_entities(Score.breakdown)], sign=-1)
+        query.delete(synchronize_session=False)
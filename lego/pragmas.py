@@ -0,0 +1,68 @@
+# -----------------------------------------------------------------------------
+# SQLite connection tuning.
+#
+# Applies the SQLITE_* settings from the configuration to every new SQLite
+# connection. Write-ahead logging lets the scoreboards keep reading while the
+# judges submit scores, rather than waiting on the writer's lock.
+# -----------------------------------------------------------------------------
+
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from lego import app
+
+
+__all__ = ['DEFAULTS', 'get_pragmas', 'apply_pragmas']
+
+# settings used if they are missing from config.py, in the order they are applied
+# the busy timeout comes first so changing the journal mode waits for other connections
+DEFAULTS = (
+    ('SQLITE_BUSY_TIMEOUT', 'busy_timeout', 5000),
+    ('SQLITE_JOURNAL_MODE', 'journal_mode', 'WAL'),
+    ('SQLITE_SYNCHRONOUS', 'synchronous', 'NORMAL'),
+    ('SQLITE_CACHE_SIZE', 'cache_size', -16000),
+    ('SQLITE_MMAP_SIZE', 'mmap_size', 64 * 1024 * 1024),
+)
+
+
+def get_pragmas(config) -> list:
+    '''
+    Get the pragmas to apply from the configuration.
+
+    :param config: The application configuration. Settings set to None are skipped.
+
+    :return: A list of (pragma, value) tuples.
+    '''
+    pragmas = []
+
+    for setting, pragma, default in DEFAULTS:
+        value = config.get(setting, default)
+
+        if value is not None:
+            pragmas.append((pragma, value))
+
+    return pragmas
+
+
+def apply_pragmas(connection, pragmas: list):
+    '''
+    Apply pragmas to a SQLite connection.
+
+    :param connection: A `sqlite3` connection.
+    :param pragmas: A list of (pragma, value) tuples as returned by `get_pragmas`.
+    '''
+    cursor = connection.cursor()
+
+    for pragma, value in pragmas:
+        cursor.execute('PRAGMA {!s} = {!s}'.format(pragma, value))
+
+    cursor.close()
+
+
+@event.listens_for(Engine, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        # always enforced so deleting a team also deletes its scores
+        apply_pragmas(dbapi_connection, [('foreign_keys', 'ON')] + get_pragmas(app.config))
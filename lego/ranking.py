@@ -0,0 +1,187 @@
+# -----------------------------------------------------------------------------
+# Ranking of teams for the scoreboards, judges pages and stage progression.
+#
+# Rather than comparing teams pairwise, which reloads the stage and rebuilds
+# the attempts on every comparison, a single tuple key is built per team for
+# the current stage and the teams are sorted on it once.
+#
+# The same order is also available as SQL so the database can rank the teams
+# and return only the rows a page displays. Requires SQLite 3.25 or later for
+# window functions.
+# -----------------------------------------------------------------------------
+
+from sqlalchemy import and_, case, func, select
+
+from lego import app
+from lego.models import Score, Team
+from lego.models.score import SLOTS
+
+
+__all__ = ['sort_key', 'rank_teams', 'highest_score', 'sql_sort_key', 'ranked_select',
+           'below_cutoff', 'RANKED_COLUMNS']
+
+# the columns of each row selected by `ranked_select`
+RANKED_COLUMNS = ('rank', 'id', 'number', 'name', 'active') + tuple(SLOTS)
+
+
+def sort_key(team, stage: int) -> tuple:
+    '''
+    Build the sort key for a team at the given stage. Higher keys rank higher.
+
+    The key is made up of the final, semi final, quarter final and round 2 scores (only those
+    reached by the given stage), the round 1 attempts from best to worst and finally the negated
+    team number so that ties are broken by the lowest team number.
+
+    :param team: The team to build the key for. Any object with the score attributes of a `Team`
+        can be used.
+    :param stage: The stage to build the key for.
+
+    :return: The sort key.
+    '''
+    key = []
+
+    if stage == 4:
+        key.append(team.final or -1)
+
+    if stage >= 3:
+        key.append(team.semi or -1)
+
+    if stage >= 2:
+        key.append(team.quarter or -1)
+
+    if stage >= 1:
+        key.append(team.round_2 or -1)
+
+    attempts = [a if a is not None else -1 for a in team.attempts]
+    attempts.sort(reverse=True)
+    key.extend(attempts)
+
+    key.append(-team.number)
+
+    return tuple(key)
+
+
+def rank_teams(teams, stage: int=None) -> list:
+    '''
+    Sort teams from highest to lowest ranked.
+
+    :param teams: An iterable of teams to rank.
+    :param stage: The stage to rank the teams for. Defaults to the current stage.
+
+    :return: A new list containing the ranked teams.
+    '''
+    if stage is None:
+        stage = app.load_stage()
+
+    return sorted(teams, key=lambda t: sort_key(t, stage), reverse=True)
+
+
+def highest_score(team, stage: int) -> int:
+    '''
+    Get the score a team is currently being judged on for the given stage.
+
+    :param team: The team to get the score for. Any object with the score attributes of a `Team`
+        can be used.
+    :param stage: The stage to get the score for.
+
+    :return: The best round 1 attempt during round 1, otherwise the score for the given stage.
+        Missing scores are treated as 0.
+    '''
+    if stage == 0:
+        return max(team.attempt_1 or 0, team.attempt_2 or 0, team.attempt_3 or 0)
+
+    if stage == 1:
+        return team.round_2 or 0
+
+    if stage == 2:
+        return team.quarter or 0
+
+    if stage == 3:
+        return team.semi or 0
+
+    if stage == 4:
+        return team.final or 0
+
+
+def _score_totals():
+    '''
+    Build a subquery holding a row per team with a column for the total of each score slot.
+    '''
+    columns = [Score.team_id.label('team_id')]
+
+    for key, (stage, attempt) in SLOTS.items():
+        total = case([(and_(Score.stage == stage, Score.attempt == attempt), Score.total)])
+        columns.append(func.max(total).label(key))
+
+    return select(columns).group_by(Score.team_id).alias('totals')
+
+
+def sql_sort_key(totals, stage: int) -> list:
+    '''
+    Build the SQL equivalent of `sort_key` as a list of ORDER BY expressions.
+
+    :param totals: A selectable with a column per score slot, e.g. from `_score_totals`.
+    :param stage: The stage to build the key for.
+
+    :return: The ORDER BY expressions, highest ranked first.
+    '''
+    key = []
+
+    # `or -1` in sort_key treats a score of 0 the same as a missing score
+    for name, reached in (('final', stage == 4), ('semi', stage >= 3), ('quarter', stage >= 2),
+                          ('round_2', stage >= 1)):
+        if reached:
+            key.append(func.coalesce(func.nullif(totals.c[name], 0), -1).desc())
+
+    a, b, c = (func.coalesce(totals.c[k], -1) for k in ('attempt_1', 'attempt_2', 'attempt_3'))
+
+    # SQLite's max and min return the largest and smallest of their arguments
+    best = func.max(a, b, c)
+    worst = func.min(a, b, c)
+    key.extend([best.desc(), (a + b + c - best - worst).desc(), worst.desc()])
+
+    key.append(Team.number.asc())
+
+    return key
+
+
+def ranked_select(stage: int, active_only: bool=False):
+    '''
+    Build a query ranking the non-practice teams in the database.
+
+    :param stage: The stage to rank the teams for.
+    :param active_only: Only include active teams. Ranks are then counted among the active teams.
+
+    :return: A select of `RANKED_COLUMNS`, ordered by rank. Apply `limit` and `offset` to fetch a
+        single page.
+    '''
+    totals = _score_totals()
+    key = sql_sort_key(totals, stage)
+
+    rank = func.row_number().over(order_by=key).label('rank')
+    columns = [rank, Team.id, Team.number, Team.name, Team.active]
+    columns.extend(totals.c[k] for k in SLOTS)
+
+    query = select(columns) \
+        .select_from(Team.__table__.outerjoin(totals, totals.c.team_id == Team.id)) \
+        .where(Team.is_practice == False)
+
+    if active_only:
+        query = query.where(Team.active == True)
+
+    return query.order_by(rank)
+
+
+def below_cutoff(stage: int, cutoff: int):
+    '''
+    Build a query selecting the active teams ranked below a cutoff, e.g. to deactivate them with a
+    single update when moving to the next stage.
+
+    :param stage: The stage to rank the teams for.
+    :param cutoff: The number of teams going through.
+
+    :return: A select of the ids of the active, non-practice teams ranked below the cutoff.
+    '''
+    ranked = ranked_select(stage, active_only=True).alias('ranked')
+
+    return select([ranked.c.id]).where(ranked.c.rank > cutoff)
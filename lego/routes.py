@@ -4,69 +4,228 @@
 # This is essentially the controllers for the application in terms of MVC, but all in one.
 # -------------------------------------------------------------------------------------------------
 
-from functools import cmp_to_key
-import os
+import csv
+from functools import wraps
+import json
+import logging
+import random
 import re
 import unicodedata
 
-from flask import render_template, flash, redirect, request, url_for, g, abort, make_response
+from flask import render_template, flash, redirect, request, url_for, g, abort, make_response, \
+    Response, session, stream_with_context, _request_ctx_stack
+from flask.sessions import SecureCookieSessionInterface
 from flask_login import login_user, logout_user, current_user, login_required
 from sqlalchemy  import asc
 from sqlalchemy.exc import IntegrityError
 
-from lego import app, db, lm
-from lego.forms import LoginForm, ScoreRoundForm, EditTeamForm, NewTeamForm, EditTeamScoreForm, ResetTeamScoreForm, StageForm, generate_manage_active_teams_form
-from lego.models import User, Team
+from lego import app, db, events, lm, metrics, ranking
+from lego.assets import AssetManifest, IMMUTABLE
+from lego.forms import LoginForm, ScoreRoundForm, EditTeamForm, NewTeamForm, EditTeamScoreForm, ResetTeamScoreForm, StageForm, ImportScoresForm, generate_manage_active_teams_form, apply_manage_active_teams_form
+from lego.forms.score_round_form import codec
+from lego.formats import current_format
+from lego.leaderboard import leaderboard
+from lego.models import User, Team, Score
+from lego.models.mission_stat import summary as mission_summary
+from lego.models.score import SLOTS
+from lego.score_import import import_scores, read_sheets
 import lego.util as util
 
 
+# how often, in seconds, scoreboard streams check for changes made outside this process
+STREAM_POLL_INTERVAL = 5
+
+# the number of teams to load breakdowns for at a time when exporting
+EXPORT_BATCH_SIZE = 500
+
+# the score slots included in a wide export, with their headings
+EXPORT_BREAKDOWNS = (('attempt_1', 'Round 1 - Attempt 1'),
+                     ('attempt_2', 'Round 1 - Attempt 2'),
+                     ('attempt_3', 'Round 1 - Attempt 3'),
+                     ('round_2', 'Round 2'),
+                     ('quarter', 'Quarter Final'),
+                     ('semi', 'Semi Final'),
+                     ('final', 'Final'))
+
+# the maximum number of rendered scoreboard pages to keep
+PAGE_CACHE_SIZE = 64
+
+# public pages refreshed constantly by the scoreboard displays, which don't read or write the session
+# cookie or load the logged in user, so they are shown as they are to visitors who aren't logged in.
+# Only a sample of the successful requests to them is logged, see `after_request`.
+PUBLIC_ENDPOINTS = ('scoreboard', 'top_ten', 'scoreboard_stream', 'api_leaderboard', 'static')
+
+page_cache = util.LRUCache(PAGE_CACHE_SIZE)
+
+# hashes of the static files, only checked for changes in debug mode
+asset_manifest = AssetManifest(app.static_folder)
+asset_manifest.build()
+access_logger = logging.getLogger(app.logger_name + '.access')
+leaderboard.add_listener(page_cache.clear)
+
+
+def is_public(req) -> bool:
+    '''
+    Check whether a request is for one of the `PUBLIC_ENDPOINTS`, or isn't for an event when hosting
+    several, in which case there are no users to load.
+    '''
+    if events.events and req.environ.get(events.ENVIRON_KEY) is None:
+        return True
+
+    return req.url_rule is not None and req.url_rule.endpoint in PUBLIC_ENDPOINTS
+
+
+class PublicSessionInterface(SecureCookieSessionInterface):
+    '''
+    Session interface which skips decoding and saving the session cookie for public pages.
+
+    When hosting several events, each event's session cookie is limited to the event's pages and
+    signed for the event, so logging in to one event doesn't log in to the others.
+    '''
+
+    def open_session(self, app, request):
+        # the URL has already been matched when the session is opened
+        if is_public(request):
+            return self.make_null_session(app)
+
+        return super(PublicSessionInterface, self).open_session(app, request)
+
+    def get_cookie_path(self, app):
+        event = events.current_event()
+
+        if event is None:
+            return super(PublicSessionInterface, self).get_cookie_path(app)
+
+        return event.prefix + '/'
+
+    def get_signing_serializer(self, app):
+        serializer = super(PublicSessionInterface, self).get_signing_serializer(app)
+        event = events.current_event()
+
+        if serializer is not None and event is not None:
+            serializer.salt = '{!s}/{!s}'.format(self.salt, event.name)
+
+        return serializer
+
+
+app.session_interface = PublicSessionInterface()
+
+
 @app.before_request
 def before_request():
     '''
-    Set up user global.
+    Set up user global. Public pages use an anonymous user rather than loading the logged in user.
+
+    When hosting several events, requests which aren't for an event only get the list of events.
     '''
+    if is_public(request):
+        _request_ctx_stack.top.user = lm.anonymous_user()
+
     g.user = current_user
 
+    if events.events and events.current_event() is None and request.endpoint != 'static':
+        if request.path != '/':
+            return abort(404)
+
+        return render_template('events.html', title='Events', events=events.events.values())
+
 
 @app.context_processor
 def override_url_for():
     '''
     Override for addding a cache buster to static assets.
     '''
-    return dict(url_for=dated_url_for)
+    return dict(url_for=hashed_url_for)
 
 
-def dated_url_for(endpoint, **values):
+def hashed_url_for(endpoint, **values):
     '''
-    Append a cache buster to static assets.
-
-    Based on: <http://flask.pocoo.org/snippets/40/>
+    Append the hash of the file's content to the URLs of static assets, so they can be cached
+    forever. See `lego.assets`.
     '''
     if endpoint == 'static':
-        filename = values.get('filename', None)
+        digest = asset_manifest.get(values.get('filename') or '', refresh=app.debug)
 
-        if filename:
-            file_path = os.path.join(app.root_path,
-                                     endpoint, filename)
-            values['q'] = int(os.stat(file_path).st_mtime)
+        if digest:
+            values['v'] = digest
 
     return url_for(endpoint, **values)
 
 
+@app.after_request
+def cache_static(response):
+    '''
+    Let browsers cache static assets requested with their current hash without ever checking
+    whether they have changed, as a change gives them a new URL.
+    '''
+    if request.endpoint == 'static' and response.status_code == 200:
+        digest = request.args.get('v')
+        filename = request.view_args.get('filename', '')
+
+        if digest and digest == asset_manifest.get(filename, refresh=app.debug):
+            response.headers['Cache-Control'] = IMMUTABLE
+
+    return response
+
+
 @app.after_request
 def after_request(response):
     '''
-    Log all requests.
+    Log requests. Only a sample of the successful requests to the scoreboards is logged, see
+    `LOG_SAMPLE_RATE` in the config.
     '''
-    app.logger.info('%s %s %s %s %s',
-                    request.remote_addr,
-                    request.method,
-                    request.scheme,
-                    request.full_path,
-                    response.status)
+    if response.status_code < 400 and \
+            request.endpoint in app.config.get('LOG_SAMPLED_ENDPOINTS', PUBLIC_ENDPOINTS) and \
+            random.random() >= app.config.get('LOG_SAMPLE_RATE', 0.1):
+        return response
+
+    access_logger.info('%s %s %s %s %s',
+                       request.remote_addr,
+                       request.method,
+                       request.scheme,
+                       request.full_path,
+                       response.status,
+                       extra={'remote_addr': request.remote_addr,
+                              'method': request.method,
+                              'path': request.full_path,
+                              'status': response.status_code})
     return response
 
 
+def cached_page(view):
+    '''
+    Decorator for caching the HTML of a public page that only depends on the leaderboard.
+
+    The page is cached per event, app type, stage, URL arguments, leaderboard version and type of
+    user as the navigation differs for judges and admins. Pages with flashed messages are never
+    cached.
+    '''
+    @wraps(view)
+    def wrapper(**kwargs):
+        if session.get('_flashes'):
+            return view(**kwargs)
+
+        user_type = (current_user.is_authenticated, getattr(current_user, 'is_judge', False),
+                     getattr(current_user, 'is_admin', False))
+        key = (events.current_name(), request.endpoint, tuple(sorted(kwargs.items())),
+               current_format().name, app.load_stage(), leaderboard.current_version(), user_type)
+
+        html = page_cache.get(key)
+
+        if html is None:
+            html = view(**kwargs)
+
+            # don't cache redirects
+            if not isinstance(html, str):
+                return html
+
+            page_cache.set(key, html)
+
+        return html
+
+    return wrapper
+
+
 @app.template_filter('slugify')
 def slugify(value: str):
     '''
@@ -160,87 +319,194 @@ def home():
     return render_template('home.html', title='Home', teams=teams)
 
 @app.route('/top_ten')
+@cached_page
 def top_ten():
-    teams = Team.query.filter_by(is_practice=False).all()
-    teams = sorted(teams, key=cmp_to_key(util.compare_teams))
-    teams = teams[0:10]
     stage = app.load_stage()
-    params = {
-        'title': 'Scoreboard',
-        'stage': stage,
-        'teams': teams,
-    }
-
-    template = 'top_ten.html'
-    stages = ('round_1', 'round_2', 'quarter_final', 'semi_final', 'final')
-    for i, s in enumerate(stages):
-        if stage >= i:
-            params[s] = True
+    teams = leaderboard.page(0, 10, active_only=False)
 
-    return render_template(template, **params)
+    return render_template('top_ten.html', **top_ten_params(teams, stage))
 
 @app.route('/scoreboard/', defaults={'offset': 0})
 @app.route('/scoreboard/<int:offset>')
+@cached_page
 def scoreboard(offset):
-    teams = Team.query.filter_by(active=True, is_practice=False).all()
-    teams = sorted(teams, key=cmp_to_key(util.compare_teams))
     stage = app.load_stage()
+    layout = current_format().layout
+    template = 'scoreboard_{!s}.html'.format(layout)
+
+    # only the paginated scoreboard can be loaded a page at a time
+    if stage == 0 and layout == 'uk':
+        params = scoreboard_params(leaderboard.page(offset, 10), stage, layout, offset,
+                                   leaderboard.count())
+        return render_template(template, **params)
+
+    # force offset to 0 if we refreshed in the middle of a cycle
+    if stage != 0 and offset != 0:
+        return redirect(url_for('scoreboard'))
+
+    params = scoreboard_params(leaderboard.get().active, stage, layout, offset)
+
+    return render_template(template, **params)
+
+
+def _stage_params(stage: int) -> dict:
+    '''
+    Build the template parameters shared by the scoreboard pages, flagging each stage reached that
+    the competition format uses.
+    '''
     params = {
         'title': 'Scoreboard',
         'stage': stage,
-        'offset': offset,
-        'end': len(teams)
     }
+    competition_format = current_format()
 
-    if app.config['LEGO_APP_TYPE'] in ('bristol', 'uk'):
-        template = 'scoreboard_{!s}.html'.format(app.config['LEGO_APP_TYPE'])
+    for i, s in enumerate(('round_1', 'round_2', 'quarter_final', 'semi_final', 'final')):
+        if stage >= i and competition_format.is_used(i):
+            params[s] = True
+
+    return params
+
+
+def top_ten_params(teams: list, stage: int) -> dict:
+    '''
+    Build the template parameters for the top ten page.
+
+    :param teams: The top ten teams, ranked from highest to lowest.
+    :param stage: The current stage.
+
+    :return: The parameters for `top_ten.html`.
+    '''
+    params = _stage_params(stage)
+    params['teams'] = teams
+
+    return params
+
+
+def scoreboard_params(teams: list, stage: int, layout: str, offset: int=0,
+                      end: int=None) -> dict:
+    '''
+    Build the template parameters for a scoreboard, laid out for the competition format.
+
+    :param teams: The teams to show, ranked from highest to lowest.
+    :param stage: The current stage.
+    :param layout: The scoreboard layout of the competition format, `bristol` or `uk`.
+    :param offset: The number of teams ranked above the first team shown.
+    :param end: The total number of teams on the scoreboard. Defaults to the number shown.
+
+    :return: The parameters for `scoreboard_bristol.html` or `scoreboard_uk.html`.
+    '''
+    params = _stage_params(stage)
+    params['offset'] = offset
+    params['end'] = len(teams) if end is None else end
+
+    if layout == 'uk':
+        params['teams'] = teams
+
+        # only round 1 is shown a page at a time
+        if stage != 0:
+            params['no_pagination'] = True
+    elif stage == 0:
+        quotient = len(teams) // 3
+        remainder = len(teams) % 3
+
+        # remainder == 0
+        if not remainder:
+            params['first'] = teams[:quotient]
+            params['second'] = teams[quotient:(quotient * 2)]
+            params['third'] = teams[(quotient * 2):]
+
+        elif remainder == 1:
+            params['first'] = teams[:(quotient + 1)]
+            params['second'] = teams[quotient + 1:(quotient * 2) + 1]
+            params['third'] = teams[(quotient * 2) + 1:]
+
+        # remainder == 2
+        else:
+            params['first'] = teams[:(quotient)]
+            params['second'] = teams[quotient:(quotient * 2) + 1]
+            params['third'] = teams[(quotient * 2) + 1:]
     else:
-        raise Exception('Unsupported value for LEGO_APP_TYPE: {!s}' \
-                        .format(app.config['LEGO_APP_TYPE']))
+        params['first'] = teams
 
-    stages = ('round_1', 'round_2', 'quarter_final', 'semi_final', 'final')
-    for i, s in enumerate(stages):
-        if stage >= i:
-            params[s] = True
+    return params
 
-    if stage == 0:
-        if app.config['LEGO_APP_TYPE'] == 'bristol':
-            quotient = len(teams) // 3
-            remainder = len(teams) % 3
 
-            # remainder == 0
-            if not remainder:
-                params['first'] = teams[:quotient]
-                params['second'] = teams[quotient:(quotient * 2)]
-                params['third'] = teams[(quotient * 2):]
+@app.route('/scoreboard/stream')
+def scoreboard_stream():
+    '''
+    Server-sent events stream of the leaderboard for the live scoreboards.
 
-            elif remainder == 1:
-                params['first'] = teams[:(quotient + 1)]
-                params['second'] = teams[quotient + 1:(quotient * 2) + 1]
-                params['third'] = teams[(quotient * 2) + 1:]
+    An event is only sent when the leaderboard changes. Use `?scope=top_ten` for the top ten page,
+    otherwise all active teams are sent.
+    '''
+    top_ten = request.args.get('scope') == 'top_ten'
 
-            # remainder == 2
+    def generate():
+        version = None
+
+        # let the browser reconnect quickly if the server restarts
+        yield 'retry: {:d}\n\n'.format(STREAM_POLL_INTERVAL * 1000)
+
+        while True:
+            standings = leaderboard.get()
+
+            # don't hold on to a database connection while idle
+            db.session.remove()
+
+            if standings.version != version:
+                version = standings.version
+                teams = standings.teams[0:10] if top_ten else standings.active
+                data = json.dumps(standings.to_dict(teams), separators=(',', ':'))
+                yield 'event: leaderboard\ndata: {!s}\n\n'.format(data)
             else:
-                params['first'] = teams[:(quotient)]
-                params['second'] = teams[quotient:(quotient * 2) + 1]
-                params['third'] = teams[(quotient * 2) + 1:]
+                # keeps the connection alive and lets us notice when the client has gone
+                yield ': ping\n\n'
 
-            return render_template(template, **params)
-        else:
-            params['teams'] = teams[offset:offset + 10]
-            return render_template(template, **params)
+            leaderboard.wait(version, STREAM_POLL_INTERVAL)
 
-    # force offset to 0 if we refreshed in the middle of a cycle
-    if params['offset'] != 0:
-        return redirect(url_for('scoreboard'))
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
 
-    if app.config['LEGO_APP_TYPE'] == 'bristol':
-        params['first'] = teams
-    else:
-        params['teams'] = teams
-        params['no_pagination'] = True
+    return resp
 
-    return render_template(template, **params)
+
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    '''
+    The ranked teams for the current stage as JSON.
+
+    Supports conditional requests using a hash of the ranked teams as the entity tag, which is the
+    same from every worker, so polling clients only receive the teams when they have changed. A
+    `304` is answered from the standings held in memory, without querying or ranking the teams.
+    The tag is weak as the `version` in the body counts changes seen by the worker. Query
+    parameters:
+    - scope: `active` (default) for the teams on the scoreboard or `all` for every team.
+    - offset: The number of teams to skip. Defaults to 0.
+    - limit: The maximum number of teams to return. Defaults to all teams.
+    '''
+    etag = leaderboard.etag()
+
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag, weak=True)
+        return resp
+
+    standings = leaderboard.get()
+    teams = standings.teams if request.args.get('scope') == 'all' else standings.active
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', len(teams), type=int)
+    limit = max(limit, 0)
+
+    data = standings.to_dict(teams[offset:offset + limit], offset)
+    data['total'] = len(teams)
+
+    resp = Response(json.dumps(data, separators=(',', ':')), mimetype='application/json')
+    resp.set_etag(standings.etag, weak=True)
+    resp.headers['Cache-Control'] = 'no-cache'
+
+    return resp
 
 
 @app.route('/judges/')
@@ -250,23 +516,60 @@ def judges_home():
     if not (current_user.is_judge or current_user.is_admin):
         return abort(403)
 
-    teams = Team.query.filter_by(is_practice=False).all()
-    teams = sorted(teams, key=cmp_to_key(util.compare_teams))
+    teams = leaderboard.get().teams
 
-    show_round_2 = app.config['LEGO_APP_TYPE'] == 'uk'
+    show_round_2 = current_format().is_used(1)
 
     return render_template('judges/home.html', title='Judges - Home', teams=teams,
                            show_round_2=show_round_2)
 
 
+@app.route('/judges/missions')
+@login_required
+def judges_missions():
+    '''
+    How often each mission has scored and its mean points in each stage.
+    '''
+    if not (current_user.is_judge or current_user.is_admin):
+        return abort(403)
+
+    stages = mission_summary(current_format().stages, codec.missions)
+
+    return render_template('judges/missions.html', title='Judges - Missions', stages=stages)
+
+
+@app.route('/api/missions')
+@login_required
+def api_missions():
+    '''
+    The mission statistics shown on the judges missions page as JSON. The success rate is the
+    fraction of the scores in the stage in which the mission scored any points.
+    '''
+    if not (current_user.is_judge or current_user.is_admin):
+        return abort(403)
+
+    data = {'stages': mission_summary(current_format().stages, codec.missions)}
+
+    resp = Response(json.dumps(data, separators=(',', ':')), mimetype='application/json')
+    resp.headers['Cache-Control'] = 'no-cache'
+
+    return resp
+
+
 @app.route('/judges/export')
 @login_required
 def judges_export():
+    '''
+    Export the ranked teams and their scores as CSV.
+
+    The rows are streamed as they are written. Use `?wide=1` to add a column per mission for each
+    score holding the points from the score's breakdown.
+    '''
     if not(current_user.is_judge or current_user.is_admin):
         return abort(403)
 
-    teams = Team.query.filter_by(is_practice=False).all()
-    teams = sorted(teams, key=cmp_to_key(util.compare_teams))
+    teams = leaderboard.get().teams
+    wide = request.args.get('wide') == '1'
 
     headers = ['Rank', 'Number', 'Name', 'Round 1 - Attempt 1', 'Round 1 - Attempt 2',
                'Round 1 - Attempt 3', 'Round 1 - Best', 'Round 2', 'Quarter Final', 'Semi Final',
@@ -274,29 +577,40 @@ def judges_export():
     columns = ['number', 'name', 'attempt_1', 'attempt_2', 'attempt_3', 'best_attempt', 'round_2',
                'quarter', 'semi', 'final']
 
-    csv_parts = []
-    csv_parts.append(','.join(headers))
+    if wide:
+        missions = codec.missions
+
+        for _, heading in EXPORT_BREAKDOWNS:
+            headers.extend('{!s} - {!s}'.format(heading, m) for m in missions)
+
+    def generate():
+        writer = csv.writer(_CSVLine())
+        yield writer.writerow(headers)
 
-    for i, t in enumerate(teams, start=1):
-        row = [str(i)]
+        # breakdowns aren't held by the leaderboard so load them a batch at a time
+        for start in range(0, len(teams), EXPORT_BATCH_SIZE):
+            batch = teams[start:start + EXPORT_BATCH_SIZE]
+            breakdowns = _load_breakdowns(batch) if wide else {}
 
-        for c in columns:
-            x = getattr(t, c)
+            for rank, t in enumerate(batch, start=start + 1):
+                row = [rank]
 
-            if x is None:
-                x = ''
+                for c in columns:
+                    x = getattr(t, c)
+                    row.append('' if x is None else x)
 
-            x = str(x)
-            row.append(x)
+                if wide:
+                    for breakdown in breakdowns[t.id]:
+                        points = codec.decode(breakdown)
+                        row.extend(points.get(m, '') for m in missions)
 
-        csv_parts.append(','.join(row))
+                yield writer.writerow(row)
 
-    resp = make_response('\n'.join(csv_parts))
+    resp = Response(stream_with_context(generate()), mimetype='text/csv')
 
-    resp.headers['Content-Type'] = 'text/csv'
-    resp.headers['Content-Disposition'] = 'attachment; filename="teams.csv"'
+    filename = 'teams_breakdown.csv' if wide else 'teams.csv'
+    resp.headers['Content-Disposition'] = 'attachment; filename="{!s}"'.format(filename)
     resp.headers['Content-Transfer-Encoding'] = 'binary'
-    resp.headers['Accept-Ranges'] = 'bytes'
     resp.headers['Cache-Control'] = 'private'
     resp.headers['Pragma'] = 'private'
     # the exact date doesn't matter here as long as it's in the past so it
@@ -309,6 +623,35 @@ def judges_export():
     return resp
 
 
+class _CSVLine(object):
+    '''
+    A file-like object for `csv.writer` that returns each written line instead of storing it.
+    '''
+
+    def write(self, value):
+        return value
+
+
+def _load_breakdowns(teams) -> dict:
+    '''
+    Load the score breakdowns for a batch of teams.
+
+    :return: A dict mapping team ids to a tuple of breakdowns in the order of `EXPORT_BREAKDOWNS`.
+    '''
+    slots = {SLOTS[k]: i for i, (k, _) in enumerate(EXPORT_BREAKDOWNS)}
+    breakdowns = {t.id: [None] * len(EXPORT_BREAKDOWNS) for t in teams}
+    rows = db.session.query(Score.team_id, Score.stage, Score.attempt, Score.breakdown) \
+        .filter(Score.team_id.in_(list(breakdowns)))
+
+    for team_id, stage, attempt, breakdown in rows:
+        i = slots.get((stage, attempt))
+
+        if i is not None:
+            breakdowns[team_id][i] = breakdown
+
+    return {k: tuple(v) for k, v in breakdowns.items()}
+
+
 @app.route('/judges/score_round', methods=['GET', 'POST'])
 @login_required
 def judges_score_round():
@@ -494,6 +837,48 @@ def admin_team_score_reset(id: int):
     return render_template('admin/team_score_reset.html', title='Reset Team Score', form=form)
 
 
+@app.route('/admin/scores/import', methods=['GET', 'POST'])
+@login_required
+def admin_scores_import():
+    '''
+    For importing score sheets keyed in from paper in bulk.
+    '''
+    if not current_user.is_admin:
+        return abort(403)
+
+    form = ImportScoresForm()
+    errors = []
+
+    if form.validate_on_submit():
+        try:
+            lines = form.sheets.data.read().decode('utf-8-sig').splitlines()
+        except UnicodeDecodeError:
+            errors = [(0, 'The file must be UTF-8 encoded text.')]
+        else:
+            sheets, errors = read_sheets(lines)
+            count, import_errors = import_scores(sheets, save=not errors)
+            errors = sorted(errors + import_errors)
+
+        if not errors:
+            flash('{:d} scores imported.'.format(count))
+            return redirect(url_for('admin_scores_import'))
+
+    return render_template('admin/scores_import.html', title='Import Scores', form=form,
+                           import_errors=errors)
+
+
+@app.route('/admin/metrics')
+@login_required
+def admin_metrics():
+    '''
+    Request, SQL and template timings in the Prometheus text format.
+    '''
+    if not current_user.is_admin:
+        return abort(403)
+
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/admin/stage', methods=['GET', 'POST'])
 @login_required
 def admin_stage():
@@ -503,29 +888,23 @@ def admin_stage():
     if not current_user.is_admin:
         return abort(403)
 
-    stages = ('First Round', 'Second Round (UK Final only)', 'Quarter Final', 'Semi Final', 'Final')
-
+    competition_format = current_format()
     stage = app.load_stage()
-    current_stage = stages[stage]
+    current_stage = competition_format.stage_name(stage)
 
     form = StageForm()
+    form.stage.choices = [(str(s.number), s.name) for s in competition_format.stages]
 
     if form.validate_on_submit():
         new_stage = int(form.stage.data)
-        cur_file_path = os.path.dirname(os.path.abspath(__file__))
 
         if new_stage <= stage:
             flash('Unable to go back a stage.')
-
-        elif app.config['LEGO_APP_TYPE'] == 'bristol' and new_stage == 1:
-            flash('Round 2 only available during UK Final.')
         else:
             set_active_teams(new_stage)
+            app.save_stage(new_stage)
 
-            with open(os.path.join(cur_file_path, 'tmp', '.stage'), 'w') as fh:
-                fh.write(str(new_stage))
-
-            flash('Stage updated to: {!s}'.format(stages[int(new_stage)]))
+            flash('Stage updated to: {!s}'.format(competition_format.stage_name(new_stage)))
             return redirect(url_for('admin_stage'))
 
     return render_template('admin/stage.html', title='Manage Stage', form=form,
@@ -535,34 +914,16 @@ def admin_stage():
 def set_active_teams(stage):
     '''
     Helper for setting the active teams after a stage has been moved forward.
-    '''
-    teams = Team.query.filter_by(active=True, is_practice=False).all()
-    teams = sorted(teams, key=cmp_to_key(util.compare_teams))
-
-    if app.config['LEGO_APP_TYPE'] == 'bristol':
-        for i, team in enumerate(teams):
-            if stage == 2 and i >= 6:
-                team.active = False
-
-            if stage == 3 and i >= 4:
-                team.active = False
 
-            if stage == 4 and i >= 2:
-                team.active = False
-
-    elif app.config['LEGO_APP_TYPE'] == 'uk':
-        for i, team in enumerate(teams):
-            if stage == 1 and i >= 12:
-                team.active = False
-
-            if stage == 2 and i >= 8:
-                team.active = False
-
-            if stage == 3 and i >= 4:
-                team.active = False
+    The active teams ranked below the stage's cutoff in the competition format are deactivated with
+    a single update, ranked by the database for the stage being left.
+    '''
+    cutoff = current_format().cutoff(stage)
 
-            if stage == 4 and i >= 2:
-                team.active = False
+    if cutoff is not None:
+        below = ranking.below_cutoff(app.load_stage(), cutoff)
+        Team.query.filter(Team.id.in_(below)) \
+            .update({Team.active: False}, synchronize_session=False)
 
     db.session.commit()
 
@@ -578,10 +939,7 @@ def admin_manage_active_teams():
     form = generate_manage_active_teams_form()
 
     if form.validate_on_submit():
-        for t in form.teams:
-            is_active = form[str(t.id) + '_active'].data
-            t.active = is_active
-
+        apply_manage_active_teams_form(form)
         db.session.commit()
 
     return render_template('admin/manage_active_teams.html', title='Manage Active Teams',
@@ -0,0 +1,219 @@
+# -----------------------------------------------------------------------------
+# Importing score sheets in bulk.
+#
+# Score sheets filled in on paper are keyed in to a JSON lines or CSV file and
+# imported together, rather than submitting the score form once per team. The
+# sheets are scored and given their attempts as the score form would, and are
+# saved in a single transaction only if every sheet is valid.
+# -----------------------------------------------------------------------------
+
+import csv
+import json
+
+from sqlalchemy.exc import IntegrityError
+
+from lego import app, db
+from lego.forms.score_round_form import codec, program
+from lego.leaderboard import leaderboard
+from lego.models import Score, Team
+from lego.models.mission_stat import record_scores
+from lego.formats import current_format
+
+
+__all__ = ['read_sheets', 'import_scores']
+
+# the field holding the team number in each sheet
+TEAM_FIELD = 'team'
+
+# values meaning a task wasn't done, as paper sheets are keyed in with a mix of these
+BLANK_VALUES = ('', '0', 'n', 'no', 'false')
+
+
+def read_sheets(lines) -> (list, list):
+    '''
+    Read score sheets from a JSON lines or CSV file.
+
+    JSON lines files have an object per line. CSV files have a header row naming the fields. Both
+    hold the team number in a `team` field and the answer to each task in a field named as in the
+    score form, e.g. `M01 - Space Travel-1`. Tasks left blank, or answered with 0, no or false, are
+    treated as not done.
+
+    :param lines: An iterable of lines, e.g. an open file. The format is detected from the first
+        line that isn't blank.
+
+    :return: A tuple of the sheets, as a list of (line number, sheet), and any errors, as a list of
+        (line number, message).
+    '''
+    lines = iter(lines)
+    start = []
+
+    for line in lines:
+        start.append(line)
+
+        if line.strip():
+            break
+
+    lines = _chain(start, lines)
+
+    if start and start[-1].lstrip().startswith('{'):
+        return _read_json_lines(lines)
+
+    return _read_csv(lines)
+
+
+def _chain(first: list, rest):
+    '''
+    Helper for putting back the lines read to detect the format.
+    '''
+    yield from first
+    yield from rest
+
+
+def _read_json_lines(lines) -> (list, list):
+    sheets = []
+    errors = []
+
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            data = json.loads(line)
+        except ValueError as exc:
+            errors.append((line_no, 'Invalid JSON: {!s}'.format(exc)))
+            continue
+
+        if not isinstance(data, dict):
+            errors.append((line_no, 'Expected an object'))
+            continue
+
+        sheet = {}
+
+        for field, value in data.items():
+            if value is True:
+                value = 'y'
+            elif value is None or value is False:
+                continue
+
+            sheet[field] = str(value)
+
+        sheets.append((line_no, _strip_blanks(sheet)))
+
+    return sheets, errors
+
+
+def _read_csv(lines) -> (list, list):
+    reader = csv.DictReader(lines, skipinitialspace=True)
+    sheets = []
+
+    for row in reader:
+        sheet = {k.strip(): (v or '').strip() for k, v in row.items() if k is not None}
+
+        if any(sheet.values()):
+            sheets.append((reader.line_num, _strip_blanks(sheet)))
+
+    return sheets, []
+
+
+def _strip_blanks(sheet: dict) -> dict:
+    '''
+    Helper for removing the tasks that weren't done from a sheet, keeping the team number.
+    '''
+    return {k: v for k, v in sheet.items()
+            if k == TEAM_FIELD or v.strip().lower() not in BLANK_VALUES}
+
+
+def import_scores(sheets: list, stage: int=None, save: bool=True) -> (int, list):
+    '''
+    Score sheets and save them as new scores in a single transaction.
+
+    Each sheet is saved to the team's next free attempt for the stage, as the score form does, so
+    several sheets for the same team are saved to successive attempts. Practice and inactive teams
+    can't be scored. Nothing is saved if any sheet has an error.
+
+    :param sheets: A list of (line number, sheet) as returned by `read_sheets`.
+    :param stage: The stage to save the scores for. Defaults to the current stage.
+    :param save: Set to False to only check the sheets, e.g. when the file had other errors.
+
+    :return: A tuple of the number of scores saved and a list of (line number, message) for each
+        error, sorted by line number.
+    '''
+    if stage is None:
+        stage = app.load_stage()
+
+    allowed = current_format().attempts(stage)
+    known = set(program.fields) | {TEAM_FIELD}
+    teams = {number: (id_, active, is_practice) for id_, number, active, is_practice
+             in db.session.query(Team.id, Team.number, Team.active, Team.is_practice)}
+    made = {}
+
+    for team_id, attempt in db.session.query(Score.team_id, Score.attempt).filter_by(stage=stage):
+        made.setdefault(team_id, set()).add(attempt)
+
+    errors = []
+    rows = []
+
+    for line_no, sheet in sheets:
+        unknown = sorted(set(sheet) - known)
+
+        if unknown:
+            errors.append((line_no, 'Unknown fields: {!s}'.format(', '.join(unknown))))
+            continue
+
+        try:
+            number = int(sheet.get(TEAM_FIELD, ''))
+        except ValueError:
+            errors.append((line_no, 'Invalid team number: {!s}'
+                                    .format(sheet.get(TEAM_FIELD, ''))))
+            continue
+
+        if number not in teams:
+            errors.append((line_no, 'Team {:d} does not exist'.format(number)))
+            continue
+
+        team_id, active, is_practice = teams[number]
+
+        if is_practice:
+            errors.append((line_no, 'Team {:d} is the practice team'.format(number)))
+            continue
+
+        if not active:
+            errors.append((line_no, 'Team {:d} is not active'.format(number)))
+            continue
+
+        try:
+            total, breakdown = program.score(sheet)
+        except ValueError as exc:
+            errors.append((line_no, str(exc)))
+            continue
+
+        attempts = made.setdefault(team_id, set())
+        free = [a for a in range(1, allowed + 1) if a not in attempts]
+
+        if not free:
+            errors.append((line_no, 'All attempts have been made for this stage by team {:d}'
+                                    .format(number)))
+            continue
+
+        attempts.add(free[0])
+        rows.append({'team_id': team_id, 'stage': stage, 'attempt': free[0], 'total': total,
+                     'breakdown': codec.encode(breakdown)})
+
+    if errors or not save:
+        return 0, sorted(errors)
+
+    if rows:
+        try:
+            db.session.execute(Score.__table__.insert(), rows)
+            record_scores(stage, [r['breakdown'] for r in rows])
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return 0, [(0, 'Scores were saved for some of the teams during the import, '
+                           'please try again')]
+
+        leaderboard.invalidate()
+
+    app.logger.info('Imported %d scores for stage %d', len(rows), stage)
+
+    return len(rows), []
@@ -0,0 +1,131 @@
+# -----------------------------------------------------------------------------
+# Scoring of score sheets.
+#
+# The missions in missions.json are compiled once into a flat list of
+# instructions, each holding the name of the submitted field it reads, the
+# mission it scores for and its precomputed points. A score sheet is then
+# scored in a single pass over the instructions without building any forms,
+# so scripts can score large batches of sheets.
+# -----------------------------------------------------------------------------
+
+from collections import OrderedDict
+import json
+
+
+__all__ = ['ScoringProgram']
+
+# instruction types
+GATE = 0        # the mission scores nothing unless the field is ticked
+CHECKBOX = 1    # scores its points if the field is present
+CHOICE = 2      # scores the points of the chosen value
+
+# submitted values of a BooleanField which mean it isn't ticked
+FALSE_VALUES = ('false', '')
+
+
+class ScoringProgram(object):
+    '''
+    A compiled set of missions which scores submitted score sheets.
+
+    Score sheets are dicts, or multidicts such as `request.form`, mapping field names to submitted
+    values. Field names are the mission name and the index of the task in the mission joined by a
+    `-`, e.g. `M01 - Space Travel-1`, optionally with a prefix as used by the score form.
+    '''
+
+    def __init__(self, missions: dict):
+        '''
+        :param missions: The missions as loaded from missions.json. Missions are scored in order of
+            their names.
+        '''
+        self.missions = tuple(sorted(missions))
+        # every field name, including those that don't score
+        self.fields = []
+        self._instructions = []
+        self._prefixed = {}
+
+        for i, name in enumerate(self.missions):
+            for task_no, task in enumerate(missions[name]):
+                field = '{!s}-{:d}'.format(name, task_no)
+                type_ = task['type']
+                self.fields.append(field)
+
+                if type_ == 'StringField':
+                    # strings do not carry any score
+                    continue
+                elif type_ == 'BooleanField':
+                    self._instructions.append((GATE, i, field, None))
+                elif type_ == 'CheckboxField':
+                    self._instructions.append((CHECKBOX, i, field, int(task['value'])))
+                elif type_ in ('RadioField', 'SelectField'):
+                    points = {str(c['value']): int(c['value']) for c in task['choices']}
+                    self._instructions.append((CHOICE, i, field, points))
+                else:
+                    raise TypeError('The class with the name {} is not defined in the JSON '
+                                    'parser'.format(type_))
+
+    @classmethod
+    def from_json(cls, path: str) -> 'ScoringProgram':
+        '''
+        Compile the missions in a JSON file.
+
+        :param path: The path to the file, e.g. missions.json.
+
+        :return: The compiled program.
+        '''
+        with open(path) as fh:
+            return cls(json.load(fh))
+
+    def score(self, sheet, prefix: str='') -> (int, OrderedDict):
+        '''
+        Score a single score sheet.
+
+        :param sheet: The submitted values keyed by field name.
+        :param prefix: A prefix added to every field name, e.g. `missions-` for the score form.
+
+        :return: A tuple of the total score, which is never less than 0, and the points scored for
+            each mission in mission order.
+        '''
+        instructions = self._prefixed.get(prefix)
+
+        if instructions is None:
+            instructions = [(t, i, prefix + f, p) for t, i, f, p in self._instructions]
+            self._prefixed[prefix] = instructions
+
+        points = [0] * len(self.missions)
+        gated = [False] * len(self.missions)
+        get = sheet.get
+
+        for type_, i, field, value in instructions:
+            raw = get(field)
+
+            if type_ == CHOICE:
+                # unanswered choices default to 0
+                if raw is not None and raw != '':
+                    try:
+                        points[i] += value[raw]
+                    except KeyError:
+                        raise ValueError('Invalid value for {!s}: {!r}'.format(field, raw))
+            elif type_ == CHECKBOX:
+                if raw is not None:
+                    points[i] += value
+            elif raw is None or raw in FALSE_VALUES:
+                gated[i] = True
+
+        breakdown = OrderedDict()
+
+        for i, name in enumerate(self.missions):
+            breakdown[name] = 0 if gated[i] else points[i]
+
+        return max(sum(breakdown.values()), 0), breakdown
+
+    def score_many(self, sheets, prefix: str='') -> list:
+        '''
+        Score a batch of score sheets.
+
+        :param sheets: An iterable of score sheets. See `score`.
+        :param prefix: A prefix added to every field name.
+
+        :return: A list of (total, breakdown) tuples in the same order as the sheets.
+        '''
+        score = self.score
+        return [score(sheet, prefix) for sheet in sheets]
@@ -0,0 +1,198 @@
+# -----------------------------------------------------------------------------
+# A preforking server for running the application on event days.
+#
+# The master process opens the listening socket and forks a number of worker
+# processes, each accepting connections on the shared socket with a threaded
+# Werkzeug server. Workers share nothing in memory: the stage and leaderboard
+# are kept consistent between them by checking the stage file and SQLite's
+# data version, and the page caches are cleared along with the leaderboard.
+# The master restarts any worker which exits and writes the log file for all
+# of them, so only one process ever rotates it.
+# -----------------------------------------------------------------------------
+
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import signal
+import socket
+import sys
+import time
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from lego import app, db
+from lego.events import events
+
+
+__all__ = ['serve', 'warm']
+
+# the pages requested by each worker before it accepts connections
+WARM_PATHS = ('/', '/scoreboard/', '/top_ten')
+
+# how long, in seconds, to give workers to finish their requests when stopping
+STOP_TIMEOUT = 10
+
+
+class _RequestHandler(WSGIRequestHandler):
+    '''
+    Request handler which leaves logging requests to the application, see `after_request`, rather
+    than writing every request to the console.
+    '''
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def warm():
+    '''
+    Compile the templates and render the public pages of every event, which also opens its
+    database and loads its stage and leaderboard, so the first requests handled aren't slowed down
+    by doing so.
+    '''
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    client = app.test_client()
+
+    for prefix in [e.prefix for e in events.values()] or ['']:
+        for path in WARM_PATHS:
+            client.get(prefix + path)
+
+
+@contextmanager
+def _shared_logging():
+    '''
+    Pass log records from every process to a background thread in this process, which writes them,
+    until the context exits.
+    '''
+    queue_handlers = [h for h in app.logger.handlers if isinstance(h, QueueHandler)]
+    handlers = app.log_listener.handlers
+    local_queue = app.log_listener.queue
+    shared_queue = multiprocessing.get_context('fork').Queue()
+
+    app.log_listener.stop()
+    _listen(queue_handlers, shared_queue, handlers)
+
+    try:
+        yield
+    finally:
+        # stop before the queue is closed when exiting, then log in this process alone again
+        app.log_listener.stop()
+        _listen(queue_handlers, local_queue, handlers)
+
+
+def _listen(queue_handlers: list, queue, handlers: tuple):
+    for handler in queue_handlers:
+        handler.queue = queue
+
+    app.log_listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    app.log_listener.start()
+
+
+def _stop_worker(signum, frame):
+    sys.exit(0)
+
+
+def _run_worker(sock: socket.socket, host: str):
+    '''
+    Serve requests on the shared socket until told to stop.
+    '''
+    # Ctrl+C is sent to every process, the master stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _stop_worker)
+
+    warm()
+
+    server = make_server(host, 0, app, threaded=True, request_handler=_RequestHandler,
+                         fd=sock.fileno())
+    app.logger.info('Worker %d started', os.getpid())
+    server.serve_forever()
+
+
+def serve(host: str, port: int, workers: int):
+    '''
+    Run the application until interrupted or terminated.
+
+    :param host: The address to listen on, e.g. `0.0.0.0` for every address.
+    :param port: The port to listen on.
+    :param workers: The number of worker processes.
+    '''
+    if not hasattr(os, 'fork'):
+        raise RuntimeError('Running several workers requires a system supporting fork.')
+
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    # the socket is shared, so a worker woken for a connection another worker took mustn't block
+    sock.setblocking(False)
+
+    # connections must not be shared between processes
+    db.engine.dispose()
+
+    with _shared_logging():
+        _supervise(sock, host, port, workers)
+
+    sock.close()
+
+
+def _supervise(sock: socket.socket, host: str, port: int, workers: int):
+    '''
+    Start the workers and restart any which exit, until interrupted or terminated.
+    '''
+    context = multiprocessing.get_context('fork')
+    processes = {}
+    started = {}
+    stopping = []
+
+    def start(i: int):
+        process = context.Process(target=_run_worker, args=(sock, host),
+                                  name='lego-worker-{:d}'.format(i))
+        process.start()
+        processes[i] = process
+        started[i] = time.time()
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    app.logger.info('Serving on %s:%d with %d workers', host, port, workers)
+
+    for i in range(workers):
+        start(i)
+
+    while not stopping:
+        wait([p.sentinel for p in processes.values()], timeout=1)
+
+        for i, process in list(processes.items()):
+            if process.is_alive() or stopping:
+                continue
+
+            app.logger.warning('Worker %d exited with code %s, restarting', process.pid,
+                               process.exitcode)
+
+            # don't keep restarting a worker that fails as soon as it starts
+            if time.time() - started[i] < 1:
+                time.sleep(1)
+
+            start(i)
+
+    app.logger.info('Stopping workers')
+
+    for process in processes.values():
+        process.terminate()
+
+    deadline = time.time() + STOP_TIMEOUT
+
+    for process in processes.values():
+        process.join(max(deadline - time.time(), 0))
+
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+
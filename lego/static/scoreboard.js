@@ -0,0 +1,197 @@
+// Live updates for the scoreboards.
+//
+// Listens to the leaderboard stream and redraws the table in place when the scores change,
+// rather than reloading the whole page. The table to update is marked with a data-stream
+// attribute holding the stream URL. If the table has pagination, pages are cycled locally.
+(function ($) {
+    'use strict';
+
+    var $table,
+        stage,
+        offset,
+        step = 10,
+        teams = [];
+
+    function cell(value) {
+        return $('<td>').text(value === null ? '-' : value);
+    }
+
+    function row(team) {
+        var $row = $('<tr>');
+
+        $row.append(cell(team.rank), cell(team.number), cell(team.name));
+        $row.append(cell(team.attempt_1), cell(team.attempt_2), cell(team.attempt_3));
+
+        if (stage === 0) {
+            $row.append(cell(team.attempt_1 === null ? null : team.highest_score));
+        }
+
+        if (stage >= 1) {
+            $row.append(cell(team.round_2));
+        }
+
+        if (stage >= 2) {
+            $row.append(cell(team.quarter));
+        }
+
+        if (stage >= 3) {
+            $row.append(cell(team.semi));
+        }
+
+        if (stage >= 4) {
+            $row.append(cell(team.final));
+        }
+
+        return $row;
+    }
+
+    function draw() {
+        var $body = $table.find('tbody').empty(),
+            shown = teams;
+
+        if (paginated()) {
+            shown = teams.slice(offset, offset + step);
+        }
+
+        $.each(shown, function (i, team) {
+            $body.append(row(team));
+        });
+    }
+
+    function update(event) {
+        var payload = JSON.parse(event.data);
+
+        // the columns shown depend on the stage so start again from the server
+        if (payload.stage !== stage) {
+            location.reload();
+            return;
+        }
+
+        teams = $.map(payload.teams, function (values) {
+            var team = {};
+
+            $.each(payload.columns, function (i, column) {
+                team[column] = values[i];
+            });
+
+            return team;
+        });
+
+        if (offset >= teams.length) {
+            offset = 0;
+        }
+
+        draw();
+    }
+
+    function paginated() {
+        return $('.pagination').length > 0;
+    }
+
+    function page(new_offset) {
+        if (new_offset >= teams.length) {
+            new_offset = 0;
+        }
+
+        if (new_offset < 0) {
+            new_offset = 0;
+        }
+
+        offset = new_offset;
+        draw();
+
+        if (window.history && window.history.replaceState) {
+            window.history.replaceState(null, '',
+                location.pathname.split('/').slice(0, -1).join('/') + '/' + offset.toString() +
+                location.search);
+        }
+    }
+
+    function auto_paginate() {
+        var parts = location.search,
+            i;
+
+        // allow the auto pagination to be turned off
+        if (parts) {
+            parts = parts.slice(1).split('&');
+
+            for (i = 0; i < parts.length; i++) {
+                if (parts[i].indexOf('noauto') === 0) {
+                    return;
+                }
+            }
+        }
+
+        setInterval(function () {
+            page(offset + step);
+        }, 5000);
+    }
+
+    function init_pagination() {
+        var $links = $('.pagination');
+
+        $links.find('.first').click(function () {
+            page(0);
+            return false;
+        });
+
+        $links.find('.last').click(function () {
+            var new_offset = Math.floor(teams.length / step) * step;
+
+            if (new_offset === teams.length) {
+                new_offset -= step;
+            }
+
+            page(new_offset);
+            return false;
+        });
+
+        $links.find('.prev').click(function () {
+            page(offset - step);
+            return false;
+        });
+
+        $links.find('.next').click(function () {
+            var new_offset = offset + step;
+
+            if (new_offset >= teams.length) {
+                new_offset = offset;
+            }
+
+            page(new_offset);
+            return false;
+        });
+
+        auto_paginate();
+    }
+
+    function init() {
+        var source;
+
+        $table = $('table[data-stream]');
+
+        if (!$table.length) {
+            return;
+        }
+
+        stage = $table.data('stage');
+        offset = $table.data('offset') || 0;
+
+        // fall back to refreshing the page for browsers without server-sent events
+        if (!window.EventSource) {
+            setTimeout(function () {
+                location.reload();
+            }, 5000);
+            return;
+        }
+
+        source = new EventSource($table.data('stream'));
+        source.addEventListener('leaderboard', update);
+
+        if (paginated()) {
+            init_pagination();
+        }
+    }
+
+    $(init);
+}(jQuery));
@@ -2,37 +2,49 @@
 # Utility functions that don't depend on any application speific code.
 # -------------------------------------------------------------------------------------------------
 
+import ast
+from collections import OrderedDict
+import json
 import logging
 from logging import Formatter
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
+import tempfile
+import threading
+import time
 
 
-__all__ = ['create_log_handler', 'load_stage', 'compare_teams']
+__all__ = ['create_log_handler', 'create_queue_handler', 'JSONFormatter', 'StageStore',
+           'load_stage', 'save_stage', 'compare_teams', 'LRUCache', 'parse_breakdown']
 
 # 1 MiB
 MB = 1024 * 1024
 
-def create_log_handler(name, level=logging.DEBUG, size=MB, count=5) -> RotatingFileHandler:
+def create_log_handler(name, level=logging.INFO, size=MB, count=5,
+                       structured=True) -> RotatingFileHandler:
     '''
     Create a rotating log file handler for use by the application.
 
     :param name: A string representing the name of the log file without the file extension, e.g.
         'example'.
     :param level: The log level. Should be one of the levels defined by `logging` or the integer
-        alternative. Defaults to debug.
+        alternative. Defaults to info.
     :param size: The maximum size of the log file in bytes. Defaults to 1 MiB.
     :param count: The maximum number of log files to keep. Defaults to 5.
+    :param structured: Write a JSON object per line, see `JSONFormatter`, rather than plain text.
 
     :return: The logging handler.
     '''
-    logging.basicConfig(level=level)
     log_dir = os.path.join(os.path.dirname(__file__), 'logs')
     log_file = '{!s}.log'.format(name)
     log_path = os.path.join(log_dir, log_file)
 
-    formatter = Formatter('[%(asctime)s][%(name)s][%(levelname)s] %(message)s '
-                          '[in %(pathname)s:%(lineno)d]')
+    if structured:
+        formatter = JSONFormatter()
+    else:
+        formatter = Formatter('[%(asctime)s][%(name)s][%(levelname)s] %(message)s '
+                              '[in %(pathname)s:%(lineno)d]')
 
     fh = RotatingFileHandler(log_path, 'a', size, count)
     fh.setLevel(level)
@@ -41,6 +53,162 @@ def create_log_handler(name, level=logging.DEBUG, size=MB, count=5) -> RotatingF
     return fh
 
 
+def create_queue_handler(*handlers) -> (QueueHandler, QueueListener):
+    '''
+    Create a handler which passes records to other handlers on a background thread, so the thread
+    logging never waits for a file to be written or rotated.
+
+    :param handlers: The handlers to pass the records to, e.g. from `create_log_handler`. Each
+        handler's level is respected.
+
+    :return: A tuple of the handler to add to a logger and the listener which runs the background
+        thread. The listener must be started before any records are handled and should be stopped
+        on exit so the remaining records are written.
+    '''
+    records = queue.Queue()
+
+    return _QueueHandler(records), QueueListener(records, *handlers, respect_handler_level=True)
+
+
+class _QueueHandler(QueueHandler):
+    '''
+    Queue handler which keeps the fields of the record, so they can be formatted by the handlers
+    on the background thread.
+    '''
+
+    def prepare(self, record):
+        # merge the arguments and format any exception now, as they may change or be gone by the
+        # time the background thread gets to the record
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+_exception_formatter = Formatter()
+
+
+class JSONFormatter(Formatter):
+    '''
+    Formats a record as a JSON object on a single line, holding the time, level, logger name and
+    message, followed by any fields passed using `extra` and any exception.
+    '''
+
+    # the attributes every record has, anything else was passed using extra
+    RESERVED = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+    def format(self, record) -> str:
+        created = time.strftime('%Y-%m-%dT%H:%M:%S', self.converter(record.created))
+        data = OrderedDict([
+            ('time', '{!s}.{:03d}'.format(created, int(record.msecs))),
+            ('level', record.levelname),
+            ('logger', record.name),
+            ('message', record.getMessage()),
+        ])
+
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED:
+                data[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if record.exc_text:
+            data['exception'] = record.exc_text
+
+        return json.dumps(data, separators=(',', ':'), default=str)
+
+
+class StageStore(object):
+    '''
+    Holds the current stage in memory, backed by a file on disk.
+
+    The file is only re-read when its inode, modification time or size changes so repeated loads
+    cost a single `stat` call. Writes go to a temporary file which is then renamed over the
+    original so readers never see a partially written value.
+    '''
+
+    def __init__(self, path: str):
+        '''
+        :param path: The path to the file holding the stage.
+        '''
+        self.path = path
+        self._cached = (None, None)
+        self._lock = threading.Lock()
+
+    def load(self) -> int:
+        '''
+        Load the current stage, re-reading the file only if it has changed.
+
+        :return: An integer representing the current stage. See `load_stage`.
+        '''
+        st = os.stat(self.path)
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+        cached_signature, cached_stage = self._cached
+
+        if signature == cached_signature:
+            return cached_stage
+
+        with self._lock:
+            with open(self.path) as fh:
+                stage = _validate_stage(fh.read().strip())
+
+            self._cached = (signature, stage)
+
+        return stage
+
+    def save(self, stage: int):
+        '''
+        Atomically replace the stage file with a new stage.
+
+        :param stage: The new stage.
+        '''
+        stage = _validate_stage(stage)
+        stage_dir = os.path.dirname(self.path)
+
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=stage_dir, prefix='.stage-')
+
+            try:
+                os.fchmod(fd, 0o644)
+
+                with os.fdopen(fd, 'w') as fh:
+                    fh.write(str(stage))
+                    fh.flush()
+                    os.fsync(fh.fileno())
+
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            # force the next load to pick up the new file
+            self._cached = (None, None)
+
+
+def _validate_stage(stage) -> int:
+    '''
+    Convert a stage to an integer, ensuring it is in the valid range.
+    '''
+    stage = int(stage)
+
+    if stage < 0 or stage > 4:
+        msg = 'Invalid value for stage: {!s}. Must be an integer in the range 0-4.'
+        raise ValueError(msg.format(stage))
+
+    return stage
+
+
+stage_store = StageStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', '.stage'))
+
+
 def load_stage() -> int:
     '''
     Load the current stage.
@@ -52,17 +220,48 @@ def load_stage() -> int:
         - 3: Semi final
         - 4: Final
     '''
-    cur_path = os.path.dirname(os.path.abspath(__file__))
-    stage_path = os.path.join(cur_path, 'tmp', '.stage')
+    return stage_store.load()
 
-    with open(stage_path) as fh:
-        stage = int(fh.read().strip())
 
-    if stage < 0 or stage > 4:
-        msg = 'Invalid value for stage: {!s}. Must be an integer in the range 0-4.'
-        raise ValueError(msg.format(stage))
+def save_stage(stage: int):
+    '''
+    Save the current stage.
 
-    return stage
+    :param stage: An integer representing the new stage. See `load_stage`.
+    '''
+    stage_store.save(stage)
+
+
+def parse_breakdown(breakdown: str) -> OrderedDict:
+    '''
+    Parse a score breakdown as stored by older versions of the application, see
+    `lego.breakdowns` for the current format.
+
+    These breakdowns are the `repr` of an `OrderedDict` mapping mission names to points. They are
+    parsed as literals so the stored value is never executed.
+
+    :param breakdown: The stored breakdown. May be empty or None.
+
+    :return: The points scored for each mission, in the order they were stored.
+    '''
+    if not breakdown:
+        return OrderedDict()
+
+    value = breakdown.strip()
+    prefix = 'OrderedDict('
+
+    if value.startswith(prefix) and value.endswith(')'):
+        value = value[len(prefix):-1]
+
+    if not value:
+        return OrderedDict()
+
+    items = ast.literal_eval(value)
+
+    if isinstance(items, dict):
+        items = items.items()
+
+    return OrderedDict(items)
 
 
 def compare_teams(team_1, team_2) -> int:
@@ -76,3 +275,69 @@ def compare_teams(team_1, team_2) -> int:
         return -1
 
     return 0
+
+
+class LRUCache(object):
+    '''
+    A thread safe mapping holding a limited number of items, evicting the least recently used item
+    when full. Items can also be given a time to live, after which they are treated as missing.
+    '''
+
+    def __init__(self, maxsize: int=128, ttl: float=None):
+        '''
+        :param maxsize: The maximum number of items to hold.
+        :param ttl: The number of seconds to keep each item for after it is set, or None to keep
+            items until they are evicted.
+        '''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key to (value, expiry time)
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        '''
+        Get an item, marking it as the most recently used.
+
+        :param key: The key of the item.
+        :param default: The value to return if the item is not in the cache or has expired.
+
+        :return: The item or the default.
+        '''
+        with self._lock:
+            try:
+                value, expires = self._items.pop(key)
+            except KeyError:
+                return default
+
+            if expires is not None and expires <= time.monotonic():
+                return default
+
+            self._items[key] = (value, expires)
+            return value
+
+    def set(self, key, value):
+        '''
+        Add or replace an item, evicting the least recently used item if the cache is full.
+
+        :param key: The key of the item.
+        :param value: The item.
+        '''
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, expires)
+
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        '''
+        Remove all items.
+        '''
+        with self._lock:
+            self._items.clear()
@@ -1,6 +1,7 @@
 #! /usr/bin/env bash
 # -----------------------------------------------------------------------------
-# Run flask application on any public IP address, on port 5000
+# Run flask application on any public IP address, on port 5000, with a worker
+# process per CPU
 # -----------------------------------------------------------------------------
 
-flask run --host=0.0.0.0 --port=5000 --no-debugger --with-threads --no-reload >/dev/null 2>&1
+flask serve --host=0.0.0.0 --port=5000 >/dev/null 2>&1
@@ -0,0 +1,96 @@
+# -----------------------------------------------------------------------------
+# Tests that the database ranks teams in the same order as the application.
+#
+# Random sets of teams are saved to a temporary SQLite database and ranked by
+# `ranking.ranked_select` for every stage, then compared with the order given
+# by `ranking.rank_teams`, which is used for stage progression. The scores
+# include missing scores, zeros and ties.
+# -----------------------------------------------------------------------------
+
+import random
+
+import pytest
+from sqlalchemy import create_engine
+
+from lego import db, ranking
+from lego.leaderboard import Entry
+from lego.models import Score, Team
+from lego.models.score import SLOTS
+
+
+# the number of random sets of teams to check, and the number of teams in each
+TRIALS = 100
+TEAMS = 30
+
+# few distinct values so that ties are common
+VALUES = (None, None, 0, 10, 20, 30)
+
+
+@pytest.fixture(scope='module')
+def engine(tmpdir_factory):
+    path = tmpdir_factory.mktemp('ranking').join('ranking.db')
+    engine = create_engine('sqlite:///' + str(path))
+    db.metadata.create_all(engine, tables=[Team.__table__, Score.__table__])
+
+    yield engine
+
+    engine.dispose()
+
+
+def save_random_teams(engine, rng: random.Random, teams: int) -> list:
+    '''
+    Replace the teams in the database with a random set of teams, along with a practice team.
+
+    :param engine: The engine of the temporary database.
+    :param rng: The random number generator to use.
+    :param teams: The number of teams.
+
+    :return: An entry per team, holding the same scores as the database.
+    '''
+    team_rows = []
+    score_rows = []
+    entries = []
+
+    for i, number in enumerate(sorted(rng.randint(1, teams * 10) for _ in range(teams)), start=1):
+        active = rng.randint(0, 3) > 0
+        team_rows.append({'id': i, 'number': number + i, 'name': 'Team {:d}'.format(i),
+                          'active': active, 'is_practice': False})
+        scores = {}
+
+        for key, (stage, attempt) in SLOTS.items():
+            scores[key] = rng.choice(VALUES)
+
+            if scores[key] is not None:
+                score_rows.append({'team_id': i, 'stage': stage, 'attempt': attempt,
+                                   'total': scores[key]})
+
+        entries.append(Entry((i, number + i, 'Team {:d}'.format(i), active), scores, 0))
+
+    # a practice team which should never be ranked
+    team_rows.append({'id': teams + 1, 'number': -1, 'name': 'Practice', 'active': True,
+                      'is_practice': True})
+
+    with engine.begin() as con:
+        con.execute(Score.__table__.delete())
+        con.execute(Team.__table__.delete())
+        con.execute(Team.__table__.insert(), team_rows)
+
+        if score_rows:
+            con.execute(Score.__table__.insert(), score_rows)
+
+    return entries
+
+
+@pytest.mark.parametrize('trial', range(TRIALS))
+def test_sql_ranking_matches_rank_teams(engine, trial):
+    entries = save_random_teams(engine, random.Random(trial), TEAMS)
+
+    for stage in range(5):
+        for active_only in (False, True):
+            expected = [e.id for e in ranking.rank_teams(entries, stage)
+                        if e.active or not active_only]
+            rows = engine.execute(ranking.ranked_select(stage, active_only)).fetchall()
+
+            assert [r['id'] for r in rows] == expected, \
+                'stage {:d}, active_only={!r}'.format(stage, active_only)
+            assert [r['rank'] for r in rows] == list(range(1, len(expected) + 1))